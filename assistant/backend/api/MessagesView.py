@@ -1,4 +1,6 @@
-from starlette.responses import JSONResponse
+import json
+from typing import AsyncIterator
+from starlette.responses import JSONResponse, StreamingResponse
 from backend.managers.MessagesManager import MessagesManager
 from common.paths import api_base_url
 from backend.pagination import parse_pagination_params
@@ -18,4 +20,16 @@ class MessagesView:
             message = await self.mm.retrieve_message(response)
             return JSONResponse(message.dict(), status_code=201, headers={'Location': f'{api_base_url}/messages/{response}'})
         else:
-            return JSONResponse({"chat_response": response}, status_code=200)
\ No newline at end of file
+            return JSONResponse({"chat_response": response}, status_code=200)
+
+    async def stream(self, body: MessageCreateSchema):
+        # Same as post, but the answer is sent as server-sent events while it is being generated
+        events, error_message = await self.mm.stream_message(body)
+        if error_message:
+            return JSONResponse({"error": error_message}, status_code=404)
+        return StreamingResponse(self._sse(events), media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    async def _sse(self, events: AsyncIterator[dict]) -> AsyncIterator[str]:
+        async for event in events:
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
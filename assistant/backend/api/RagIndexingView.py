@@ -1,5 +1,7 @@
 from starlette.responses import JSONResponse, Response
 from backend.managers.RagManager import RagManager
+from backend.managers.IndexingJobsManager import IndexingJobsManager
+from common.paths import api_base_url
 from fastapi import File, UploadFile, Body
 from typing import List
 from backend.pagination import parse_pagination_params
@@ -7,16 +9,42 @@ from backend.pagination import parse_pagination_params
 class RagIndexingView:
     def __init__(self):
         self.rm = RagManager()
+        self.jm = IndexingJobsManager()
     
     async def get(self, resource_id: str):
-        file = await self.rm.retrieve_file(resource_id)
-        if file is None:
+        files = await self.rm.retrieve_file(resource_id)
+        if files is None:
             return JSONResponse({"error": "File not found"}, status_code=404)
-        return JSONResponse(file.dict(), status_code=200)
+        return JSONResponse(files[0].dict(), status_code=200)
     
     async def post(self, resource_id: str, files: List[UploadFile] = File(...)): 
-        file_info_list =  await self.rm.upload_file(resource_id, files)        
-        return JSONResponse(status_code=200, content={"message": "Document added", "files": file_info_list})
+        # Files are stored and indexed by a background worker; clients poll the job for completion
+        files_to_index, duplicate_file_ids = await self.rm.save_uploads(resource_id, files)
+        if not files_to_index:
+            file_info_list = await self.rm.duplicate_file_info(duplicate_file_ids)
+            return JSONResponse(status_code=200, content={"message": "Document added", "files": file_info_list})
+
+        job_id = await self.jm.enqueue_job(resource_id, files_to_index)
+        file_info_list = [{"file_id": file["file_id"], "file_name": file["file_name"]} for file in files_to_index]
+        file_info_list += [{"file_id": file_id, "duplicate": True} for file_id in dict.fromkeys(duplicate_file_ids)]
+        return JSONResponse(status_code=202,
+                            content={"message": "Indexing queued", "job_id": job_id, "files": file_info_list},
+                            headers={'Location': f'{api_base_url}/rag-indexing-jobs/{job_id}'})
+
+    async def reindex(self, resource_id: str, file_id: str, file: UploadFile = File(...)):
+        # Only the pages of the revised document whose text changed are split and embedded again
+        if file_id in self.rm.progress:
+            return JSONResponse({"error": "File is being indexed"}, status_code=409)
+        result = await self.jm.reindex_file(resource_id, file_id, file)
+        if result is None:
+            return JSONResponse({"error": "File not found"}, status_code=404)
+        return JSONResponse(result, status_code=200)
+
+    async def job(self, job_id: str):
+        job = await self.jm.retrieve_job(job_id)
+        if job is None:
+            return JSONResponse({"error": "Job not found"}, status_code=404)
+        return JSONResponse(job.dict(), status_code=200)
 
     async def delete(self, resource_id: str, body: dict = Body(...)):        
         file_ids = body.get("file_ids")
@@ -53,6 +53,7 @@ class ResourcesView:
                 await msgm.delete_messages_from_conversation(conversation_id)
 
         success_resource = await self.rm.delete_resource(id)        
+        ragm.invalidate_vectorstore(id)
         if not success_resource:
             return JSONResponse({"error": "Resource not found "}, status_code=404)
         return Response(status_code=204)
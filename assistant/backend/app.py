@@ -1,5 +1,7 @@
 import os
+import asyncio
 from pathlib import Path
+from contextlib import asynccontextmanager
 from connexion import AsyncApp
 from connexion.resolver import MethodResolver
 from connexion.middleware import MiddlewarePosition
@@ -7,12 +9,27 @@ from starlette.middleware.cors import CORSMiddleware
 from backend.db import init_db
 from common.utils import get_env_key
 
+@asynccontextmanager
+async def lifespan(app):
+    # Start the background indexing workers, resuming any jobs interrupted by a restart
+    from backend.managers.IndexingJobsManager import IndexingJobsManager
+    from backend.managers.ModelResidencyManager import ModelResidencyManager
+    from backend.managers.RagManager import RagManager
+    indexing_jobs_manager = IndexingJobsManager()
+    await indexing_jobs_manager.start()
+    # Load the embedder and the models of recently used assistants in the background, so the first messages don't wait for them
+    warm_up = asyncio.create_task(ModelResidencyManager().warm_up(embedder=RagManager().embedder_model))
+    yield
+    warm_up.cancel()
+    await indexing_jobs_manager.shutdown()
+    RagManager().shutdown()
+
 def create_backend_app():
     # Initialize the database
     init_db()
 
     apis_dir = Path(__file__).parent.parent / 'apis' / 'paios'
-    connexion_app = AsyncApp(__name__, specification_dir=apis_dir)
+    connexion_app = AsyncApp(__name__, specification_dir=apis_dir, lifespan=lifespan)
     
     allow_origins = get_env_key(
         'PAIOS_ALLOW_ORIGINS',
@@ -0,0 +1,164 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+import numpy as np
+
+class LRUCache:
+    # Thread-safe in-memory LRU cache. Entries are evicted least recently used first once there are more than
+    # max_entries of them or, when size_of is given, once their total size exceeds max_size. Entries older than
+    # ttl seconds are treated as missing.
+    def __init__(self, max_entries: int, max_size: Optional[int] = None, size_of: Optional[Callable[[Any], int]] = None,
+                 ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size_of = size_of
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()  # key -> (value, size, stored_at)
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        # Putting an existing key again refreshes its size, e.g. after a collection has grown
+        size = self.size_of(value) if self.size_of else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self.size += size
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     (self.max_size is not None and self.size > self.max_size and len(self._entries) > 1)):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        # Snapshot of the live entries, least recently used first; doesn't count as use
+        with self._lock:
+            now = time.monotonic()
+            return [(key, entry[0]) for key, entry in self._entries.items()
+                    if self.ttl is None or now - entry[2] <= self.ttl]
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+class AnswerCache:
+    # Generated answers per (assistant, persona, model) scope. A question asked again, up to case, spacing and
+    # Unicode form, gets the cached answer back. With a `similarity` threshold, other questions reuse the answer
+    # of the most similar cached question when the cosine similarity of their embeddings is at least that; without
+    # one, only exact matches are answered.
+    def __init__(self, max_entries: int, similarity: Optional[float] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.ttl = ttl
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._scopes = {}  # scope -> LRUCache of normalized question -> (unit vector or None, answer)
+        self._lock = Lock()
+
+    def get(self, scope: Tuple[Hashable, ...], question: str) -> Optional[str]:
+        entries = self._scopes.get(scope)
+        entry = entries.get(question) if entries is not None else None
+        if entry is None:
+            return None
+        self.exact_hits += 1
+        return entry[1]
+
+    def get_similar(self, scope: Tuple[Hashable, ...], vector: Optional[List[float]]) -> Optional[str]:
+        # Called after get() missed, so it also counts the miss; without a vector or threshold nothing is similar
+        entries = self._scopes.get(scope)
+        candidates = []
+        if entries is not None and vector is not None and self.similarity is not None:
+            candidates = [(question, entry) for question, entry in entries.items() if entry[0] is not None]
+        if candidates:
+            scores = np.stack([entry[0] for _, entry in candidates]) @ self._unit(vector)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity:
+                question, (_, answer) = candidates[best]
+                entries.get(question)  # marks it recently used
+                self.semantic_hits += 1
+                return answer
+        self.misses += 1
+        return None
+
+    def put(self, scope: Tuple[Hashable, ...], question: str, vector: Optional[List[float]], answer: str):
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None:
+                entries = self._scopes[scope] = LRUCache(self.max_entries, ttl=self.ttl)
+        entries.put(question, (self._unit(vector) if vector is not None else None, answer))
+
+    def invalidate(self, assistant_id: Hashable):
+        # Scopes start with the assistant id
+        with self._lock:
+            for scope in [scope for scope in self._scopes if scope[0] == assistant_id]:
+                del self._scopes[scope]
+
+    def _unit(self, vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "scopes": len(self._scopes),
+            "entries": sum(len(entries) for entries in list(self._scopes.values())),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+        }
@@ -0,0 +1,108 @@
+import time
+import logging
+from typing import Any, Dict, List
+from uuid import UUID
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, BaseCallbackHandler, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.outputs import LLMResult
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+# Rough size of a token in characters; Ollama doesn't expose the model's tokenizer
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def merge_overlaps(docs: List[Document]) -> List[Document]:
+    # Chunks of the same page that overlap or touch (the splitter repeats chunk_overlap characters between
+    # neighbours) are joined into one document, so the repeated text is only sent once. The merged document
+    # takes the place of its best ranked chunk. Chunks without a page id or offset are kept as they are.
+    spans: Dict[Any, List[list]] = {}
+    order = []
+    for rank, doc in enumerate(docs):
+        page, start = doc.metadata.get("original_id"), doc.metadata.get("start_index")
+        if page is None or start is None:
+            order.append((rank, doc))
+            continue
+        spans.setdefault(page, []).append([start, start + len(doc.page_content), rank, doc])
+
+    for page_spans in spans.values():
+        page_spans.sort(key=lambda span: span[0])
+        merged = [page_spans[0]]
+        for start, end, rank, doc in page_spans[1:]:
+            current = merged[-1]
+            if start > current[1]:
+                merged.append([start, end, rank, doc])
+                continue
+            if end > current[1]:
+                text = current[3].page_content + doc.page_content[current[1] - start:]
+                current[3] = Document(id=current[3].id, page_content=text, metadata=current[3].metadata)
+                current[1] = end
+            current[2] = min(current[2], rank)
+        order.extend((rank, doc) for _, _, rank, doc in merged)
+    return [doc for _, doc in sorted(order, key=lambda item: item[0])]
+
+def pack_context(docs: List[Document], token_budget: int, min_tokens: int = 64) -> List[Document]:
+    # Best ranked first until the budget is spent; the document that crosses it is cut at a word
+    # boundary if at least min_tokens of room are left, everything after it is dropped
+    packed, used = [], 0
+    for doc in docs:
+        tokens = estimate_tokens(doc.page_content)
+        if used + tokens <= token_budget:
+            packed.append(doc)
+            used += tokens
+            continue
+        room = token_budget - used
+        if room >= min_tokens:
+            text = doc.page_content[:room * CHARS_PER_TOKEN]
+            text = text[:text.rfind(" ")] if " " in text else text
+            packed.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+        break
+    return packed
+
+class PackedRetriever(BaseRetriever):
+    # Post-processes another retriever's ranked results into the context sent to the LLM:
+    # overlapping neighbours are merged and the total is capped at token_budget estimated tokens
+    retriever: BaseRetriever
+    token_budget: int = 1536
+
+    def _pack(self, docs: List[Document]) -> List[Document]:
+        packed = pack_context(merge_overlaps(docs), self.token_budget)
+        logger.info(f"Context: {len(docs)} chunks ({sum(len(doc.page_content) for doc in docs)} chars) packed into "
+                    f"{len(packed)} ({sum(len(doc.page_content) for doc in packed)} chars)")
+        return packed
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self._pack(self.retriever.invoke(query, {"callbacks": run_manager.get_child()}))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return self._pack(await self.retriever.ainvoke(query, {"callbacks": run_manager.get_child()}))
+
+class PromptStatsHandler(BaseCallbackHandler):
+    # Logs the size of every prompt sent to the LLM and, when the model server reports it (Ollama does),
+    # how many tokens it counted and how long it spent evaluating the prompt
+    def __init__(self):
+        self._started: Dict[UUID, tuple] = {}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any):
+        self._started[run_id] = (sum(len(prompt) for prompt in prompts), time.perf_counter())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        chars, started = self._started.pop(run_id, (0, time.perf_counter()))
+        info = self._generation_info(response)
+        message = f"LLM call: prompt {chars} chars (~{(chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN} tokens)"
+        if info.get("prompt_eval_count") is not None:
+            message += f", prompt eval {info['prompt_eval_count']} tokens in {(info.get('prompt_eval_duration') or 0) / 1e9:.2f}s"
+        logger.info(f"{message}, total {time.perf_counter() - started:.2f}s")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._started.pop(run_id, None)
+
+    def _generation_info(self, response: LLMResult) -> Dict[str, Any]:
+        for generations in response.generations:
+            for generation in generations:
+                if generation.generation_info:
+                    return generation.generation_info
+        return {}
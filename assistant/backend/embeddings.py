@@ -0,0 +1,217 @@
+import hashlib
+import sqlite3
+import time
+import unicodedata
+from array import array
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+from backend.cache import LRUCache
+
+# set up logging
+from common.log import get_logger
+logger = get_logger(__name__)
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def normalize_query(query: str) -> str:
+    # Questions that differ only in case, spacing or Unicode form share a cache entry
+    return " ".join(unicodedata.normalize('NFKC', query).casefold().split())
+
+class EmbeddingCache:
+    # On-disk cache of embeddings keyed by (model, sha256(text)), stored as float32 blobs in SQLite.
+    # Entries are evicted least recently used first once the cache holds more than max_entries.
+    def __init__(self, path: Path, max_entries: int = 100000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS embedding (
+                                model TEXT NOT NULL,
+                                text_hash TEXT NOT NULL,
+                                vector BLOB NOT NULL,
+                                last_used REAL NOT NULL,
+                                PRIMARY KEY (model, text_hash))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_last_used ON embedding (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embedding").fetchone()[0]
+
+    def get_many(self, model: str, hashes: List[str]) -> List[Optional[List[float]]]:
+        if not hashes:
+            return []
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound parameter limit
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embedding WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embedding SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                       [(now, model, h) for h in found])
+                self._conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return [array('f', found[h]).tolist() if h in found else None for h in hashes]
+
+    def put_many(self, model: str, hashes: List[str], vectors: List[List[float]]):
+        if not hashes:
+            return
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embedding (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, h, array('f', v).tobytes(), now) for h, v in zip(hashes, vectors)]
+            )
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Evict down to 90% of the limit so eviction is not triggered on every insert
+        excess = self._count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embedding WHERE rowid IN (SELECT rowid FROM embedding ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
+        self._count -= excess
+        self.evictions += excess
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class CachedEmbeddings(Embeddings):
+    # Embeddings wrapper that only sends texts missing from the cache to the underlying embedder.
+    # Queries are cached separately in memory (LRU with a TTL) keyed by model and normalized text
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: str, query_cache: Optional[LRUCache] = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+        self.query_cache = query_cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model, hashes)
+
+        # Embed each distinct missing text once, even if it appears several times in the batch
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(hashes[i], texts[i])
+        if missing:
+            missing_hashes = list(missing.keys())
+            embedded = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put_many(self.model, missing_hashes, embedded)
+            by_hash = dict(zip(missing_hashes, embedded))
+            vectors = [vector if vector is not None else by_hash[h] for vector, h in zip(vectors, hashes)]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_cache is None:
+            return self.embeddings.embed_query(text)
+        # The normalized text is only the cache key; the embedder gets the question as it was asked
+        key = (self.model, normalize_query(text))
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.query_cache.put(key, vector)
+        return vector
+
+class BatchedEmbeddings(Embeddings):
+    # Sends documents to the embedder in batches and adapts the batch size to what the backend handles best:
+    # the batch doubles while larger batches keep improving chunks/sec and halves when a batch errors or
+    # exceeds target_latency. A failed batch is retried on its own without redoing the batches before it.
+    def __init__(self, embeddings: Embeddings, batch_size: int = 32, min_batch_size: int = 1, max_batch_size: int = 256,
+                 target_latency: float = 30.0, max_retries: int = 3, retry_delay: float = 1.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.errors = 0
+        self._batch_stats = {}  # batch size -> {"batches", "chunks", "seconds"}
+        self._lock = Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        retries = 0
+        i = 0
+        while i < len(texts):
+            batch = texts[i:i + self.batch_size]
+            start = time.perf_counter()
+            try:
+                vectors.extend(self.embeddings.embed_documents(batch))
+            except Exception as e:
+                retries += 1
+                with self._lock:
+                    self.errors += 1
+                    self.batch_size = max(self.min_batch_size, len(batch) // 2)
+                if retries > self.max_retries:
+                    raise
+                logger.warning(f"Embedding batch of {len(batch)} failed ({e}), retrying with batch size {self.batch_size}")
+                time.sleep(self.retry_delay * retries)
+                continue
+            retries = 0
+            i += len(batch)
+            self._adapt(len(batch), time.perf_counter() - start)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def _adapt(self, size: int, elapsed: float):
+        with self._lock:
+            stats = self._batch_stats.setdefault(size, {"batches": 0, "chunks": 0, "seconds": 0.0})
+            stats["batches"] += 1
+            stats["chunks"] += size
+            stats["seconds"] += elapsed
+
+            if elapsed > self.target_latency:
+                self.batch_size = max(self.min_batch_size, size // 2)
+            elif size == self.batch_size:
+                # Only grow while the larger batch is at least as fast per chunk as the smaller one
+                smaller = self._chunks_per_sec(size // 2)
+                if smaller is None or self._chunks_per_sec(size) >= smaller:
+                    self.batch_size = min(self.max_batch_size, size * 2)
+
+    def _chunks_per_sec(self, size: int) -> Optional[float]:
+        stats = self._batch_stats.get(size)
+        if not stats or stats["seconds"] <= 0:
+            return None
+        return stats["chunks"] / stats["seconds"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "batch_size": self.batch_size,
+                "errors": self.errors,
+                "chunks_per_sec": {size: self._chunks_per_sec(size) for size in sorted(self._batch_stats)}
+            }
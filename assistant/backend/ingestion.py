@@ -0,0 +1,133 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+class FileProgress:
+    # In-memory ingestion progress for one file. Stage changes are written to the File row straight away,
+    # counters are coalesced and written at most every flush_interval seconds.
+    def __init__(self, file_id: str, flush: Callable[..., Awaitable[None]], flush_interval: float = 2.0):
+        self.file_id = file_id
+        self.stage: Optional[str] = None
+        self.pages_total: Optional[int] = None
+        self.pages_processed = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.checkpoint_page: Optional[int] = None
+        self._flush = flush
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._dirty = False
+
+    def as_dict(self) -> dict:
+        return {
+            "indexing_status": self.stage,
+            "pages_total": self.pages_total,
+            "pages_processed": self.pages_processed,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "checkpoint_page": self.checkpoint_page
+        }
+
+    async def set_stage(self, stage: str):
+        self.stage = stage
+        await self.flush()
+
+    async def advance(self, pages: int = 0, chunks: int = 0, embedded: int = 0):
+        self.pages_processed += pages
+        self.chunks_total += chunks
+        self.chunks_embedded += embedded
+        self._dirty = True
+        if time.monotonic() - self._last_flush >= self._flush_interval:
+            await self.flush()
+
+    def checkpoint(self, page: int):
+        # Every page up to and including this one is durably indexed; written with the next coalesced flush,
+        # a stale checkpoint only means a resumed run redoes a few more pages
+        self.checkpoint_page = page
+        self._dirty = True
+
+    async def flush(self):
+        values = {k: v for k, v in self.as_dict().items() if v is not None}
+        await self._flush(self.file_id, **values)
+        self._last_flush = time.monotonic()
+        self._dirty = False
+
+    async def close(self):
+        if self._dirty:
+            await self.flush()
+
+class StageQueue:
+    # Bounded queue between two ingestion stages. The producer blocks once high_water items are waiting,
+    # so a fast stage can't run ahead of a slow one. Records how full the queue runs and how long each side waits:
+    # a queue that stays full points at its consumer as the bottleneck, one that stays empty at its producer.
+    def __init__(self, name: str, high_water: int):
+        self.name = name
+        self.high_water = high_water
+        self.items = 0
+        self.max_occupancy = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+        self._queue = asyncio.Queue(maxsize=high_water)
+        self._started = time.monotonic()
+        self._last_change = self._started
+        self._occupancy_time = 0.0
+
+    async def put(self, item: Any):
+        start = time.monotonic()
+        await self._queue.put(item)
+        self.put_wait += time.monotonic() - start
+        self._record(-1)
+        if item is not None:
+            self.items += 1
+        self.max_occupancy = max(self.max_occupancy, self._queue.qsize())
+
+    async def close(self):
+        # Tells the consumer there is nothing more to come
+        await self.put(None)
+
+    async def get(self) -> Any:
+        start = time.monotonic()
+        item = await self._queue.get()
+        self.get_wait += time.monotonic() - start
+        self._record(1)
+        return item
+
+    def _record(self, change: int):
+        # Integrates occupancy over time; change is how the size differed before the operation that just happened
+        now = time.monotonic()
+        self._occupancy_time += (self._queue.qsize() + change) * (now - self._last_change)
+        self._last_change = now
+
+    def avg_occupancy(self) -> float:
+        elapsed = self._last_change - self._started
+        return self._occupancy_time / elapsed if elapsed > 0 else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "high_water": self.high_water,
+            "items": self.items,
+            "max_occupancy": self.max_occupancy,
+            "avg_occupancy": round(self.avg_occupancy(), 3),
+            "put_wait": round(self.put_wait, 3),
+            "get_wait": round(self.get_wait, 3)
+        }
+
+def find_bottleneck(stages: List[str], queues: List[StageQueue]) -> str:
+    # queues[i] sits between stages[i] and stages[i + 1]. The consumer of the last queue that ran at least
+    # half full is holding everything upstream back; if none did, the first stage can't keep the rest busy
+    bottleneck = stages[0]
+    for i, queue in enumerate(queues):
+        if queue.avg_occupancy() >= queue.high_water / 2:
+            bottleneck = stages[i + 1]
+    return bottleneck
+
+async def run_stages(*stages: Awaitable):
+    # Runs the stages concurrently; if one fails the others are cancelled so none is left blocked on a queue
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -0,0 +1,182 @@
+import json
+import asyncio
+import logging
+from enum import Enum
+from uuid import uuid4
+from threading import Lock
+from typing import List, Optional
+from sqlalchemy import select, update
+from starlette.datastructures import UploadFile
+from backend.models import IndexingJob
+from backend.db import db_session_context
+from backend.schemas import IndexingJobSchema
+from backend.utils import get_current_timestamp
+from backend.managers.RagManager import RagManager, FileStatus
+from common.utils import get_env_key
+
+logger = logging.getLogger(__name__)
+
+class JobStatus(Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+class IndexingJobsManager:
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            with cls._lock:
+                if not cls._instance:
+                    cls._instance = super(IndexingJobsManager, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            with self._lock:
+                if not hasattr(self, '_initialized'):
+                    self._initialized = True
+                    self.worker_count = int(get_env_key('INDEXING_WORKERS', 2))
+                    self.queue = None
+                    self.workers = []
+
+    async def start(self):
+        # Starts the worker pool and re-queues jobs that were queued or in flight when the server last stopped
+        if self.workers:
+            return
+        self.queue = asyncio.Queue()
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        await self.recover_jobs()
+
+    async def shutdown(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.queue = None
+
+    async def enqueue_job(self, resource_id: str, files: List[dict]) -> str:
+        # Start (and recover) before inserting so the new job is not picked up twice
+        await self.start()
+        job_id = await self._create_job(resource_id, files, JobStatus.QUEUED)
+        await self.queue.put(job_id)
+        return job_id
+
+    async def reindex_file(self, resource_id: str, file_id: str, file: UploadFile) -> Optional[dict]:
+        # Re-indexing runs right away and answers with its result, but as a running job: if the server stops
+        # halfway, the next start rolls the file back and indexes the saved revision again.
+        # Start (and recover) first so recovery never mistakes this job for an interrupted one
+        await self.start()
+        rm = RagManager()
+        revision = await rm.save_revision(resource_id, file_id, file)
+        if revision is None:
+            return None
+        job_id = await self._create_job(resource_id, [revision], JobStatus.RUNNING, attempts=1)
+        try:
+            result = await rm.reindex_file(resource_id, revision)
+        except Exception as e:
+            await self._update_job(job_id, status=JobStatus.FAILED.value, error=str(e))
+            raise
+        await self._update_job(job_id, status=JobStatus.DONE.value)
+        return result
+
+    async def _create_job(self, resource_id: str, files: List[dict], status: JobStatus, attempts: int = 0) -> str:
+        timestamp = get_current_timestamp()
+        async with db_session_context() as session:
+            job = IndexingJob(id=str(uuid4()),
+                              assistant_id=resource_id,
+                              status=status.value,
+                              files=json.dumps(files),
+                              attempts=attempts,
+                              created_timestamp=timestamp,
+                              updated_timestamp=timestamp)
+            session.add(job)
+        return job.id
+
+    async def recover_jobs(self):
+        async with db_session_context() as session:
+            stmt = select(IndexingJob).filter(IndexingJob.status.in_([JobStatus.QUEUED.value, JobStatus.RUNNING.value]))
+            jobs = (await session.execute(stmt)).scalars().all()
+
+        rm = RagManager()
+        for job in jobs:
+            if job.status == JobStatus.RUNNING.value:
+                # The job was interrupted; files that didn't finish resume from their last checkpoint
+                unfinished = await self._unfinished_file_ids(job)
+                logger.info(f"Resuming interrupted indexing job {job.id} ({len(unfinished)} unfinished files)")
+                revised = {file["file_id"] for file in json.loads(job.files) if file.get("reindex")}
+                if set(unfinished) - revised:
+                    await rm.rollback_files(job.assistant_id, [file_id for file_id in unfinished if file_id not in revised])
+                if set(unfinished) & revised:
+                    await rm.rollback_reindex(job.assistant_id, [file_id for file_id in unfinished if file_id in revised])
+                await self._update_job(job.id, status=JobStatus.QUEUED.value)
+            await self.queue.put(job.id)
+
+    async def retrieve_job(self, job_id: str) -> Optional[IndexingJobSchema]:
+        async with db_session_context() as session:
+            job = (await session.execute(select(IndexingJob).filter(IndexingJob.id == job_id))).scalar_one_or_none()
+            if not job:
+                return None
+            return IndexingJobSchema(id=job.id,
+                                     assistant_id=job.assistant_id,
+                                     status=job.status,
+                                     file_ids=[file["file_id"] for file in json.loads(job.files)],
+                                     attempts=job.attempts,
+                                     error=job.error,
+                                     created_timestamp=job.created_timestamp,
+                                     updated_timestamp=job.updated_timestamp)
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.error(f"Indexing job {job_id} failed: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    async def _run_job(self, job_id: str):
+        # Claim the job atomically so it only ever runs on one worker
+        async with db_session_context() as session:
+            stmt = (update(IndexingJob)
+                    .where(IndexingJob.id == job_id, IndexingJob.status == JobStatus.QUEUED.value)
+                    .values(status=JobStatus.RUNNING.value,
+                            attempts=IndexingJob.attempts + 1,
+                            updated_timestamp=get_current_timestamp()))
+            if (await session.execute(stmt)).rowcount == 0:
+                return
+            job = (await session.execute(select(IndexingJob).filter(IndexingJob.id == job_id))).scalar_one()
+
+        rm = RagManager()
+        unfinished = await self._unfinished_file_ids(job)
+        files_to_index = [file for file in json.loads(job.files) if file["file_id"] in unfinished]
+        uploads = [file for file in files_to_index if not file.get("reindex")]
+        try:
+            if uploads:
+                await rm.index_uploads(job.assistant_id, uploads)
+            for revision in files_to_index:
+                if revision.get("reindex"):
+                    await rm.reindex_file(job.assistant_id, revision)
+        except Exception as e:
+            await self._update_job(job_id, status=JobStatus.FAILED.value, error=str(e))
+            raise
+        await self._update_job(job_id, status=JobStatus.DONE.value)
+
+    async def _unfinished_file_ids(self, job: IndexingJob) -> List[str]:
+        # Files that aren't indexed yet, and revisions that aren't what the file was last indexed from
+        rm = RagManager()
+        unfinished = []
+        for file in json.loads(job.files):
+            files = await rm.retrieve_file(file["file_id"])
+            if files and (files[0].indexing_status != FileStatus.DONE.value or
+                          (file.get("reindex") and files[0].content_hash != file["content_hash"])):
+                unfinished.append(file["file_id"])
+        return unfinished
+
+    async def _update_job(self, job_id: str, **values):
+        values["updated_timestamp"] = get_current_timestamp()
+        async with db_session_context() as session:
+            await session.execute(update(IndexingJob).where(IndexingJob.id == job_id).values(**values))
@@ -4,9 +4,10 @@ from sqlalchemy import select, delete
 from backend.models import Message, Conversation, Resource
 from backend.db import db_session_context
 from backend.schemas import MessageSchema, MessageCreateSchema
-from typing import Tuple, Optional
+from typing import AsyncIterator, Tuple, Optional
 from backend.utils import get_current_timestamp
 from backend.managers.RagManager import RagManager
+from backend.managers.ModelResidencyManager import ModelResidencyManager
 from langchain_ollama import OllamaLLM
 from common.utils import get_env_key
 from common.paths import base_dir
@@ -68,11 +69,7 @@ class MessagesManager:
                 if error_message:
                     return None, error_message
                 
-                llm = OllamaLLM(model=model_name, 
-                             num_predict=int(self.max_tokens), 
-                             temperature=float(self.temperature), 
-                             top_k=int(self.top_k), 
-                             top_p=float(self.top_p))
+                llm = self._create_llm(model_name)
                 
                 assistant_id = message_data['assistant_id']
                 query = message_data['prompt']
@@ -95,6 +92,53 @@ class MessagesManager:
         except Exception as e:
             return None, f"An unexpected error occurred while creating a message: {str(e)}"
 
+    async def stream_message(self, message_data: MessageCreateSchema) -> Tuple[Optional[AsyncIterator[dict]], Optional[str]]:
+        # The request is checked before anything is generated so errors can still be answered normally;
+        # the answer then comes as token events, followed by a done event once the message has been saved
+        async with db_session_context() as session:
+            timestamp = get_current_timestamp()
+            conversation_id = message_data.get('conversation_id')
+            if conversation_id:
+                result = await session.execute(select(Conversation).filter(Conversation.id == conversation_id))
+                conversation = result.scalar_one_or_none()
+                if not conversation:
+                    return None, "Conversation not found"
+                conversation.last_updated_timestamp = timestamp
+
+        model_name, error_message = await self.__get_llm_name__(message_data['assistant_id'])
+        if error_message:
+            return None, error_message
+        return self._stream_answer(message_data, self._create_llm(model_name), timestamp), None
+
+    async def _stream_answer(self, message_data: MessageCreateSchema, llm: OllamaLLM, timestamp: str) -> AsyncIterator[dict]:
+        conversation_id = message_data.get('conversation_id')
+        rm = RagManager()
+        parts = []
+        try:
+            async for token in rm.stream_chat_context(message_data['assistant_id'], message_data['prompt'], llm,
+                                                      conversation_id or "testing_session"):
+                parts.append(token)
+                yield {"event": "token", "data": {"token": token}}
+
+            chat_response = "".join(parts)
+            if conversation_id:
+                message_data['chat_response'] = chat_response
+                message_data['timestamp'] = timestamp
+                msg_id, msg_error = await self.save_message(message_data)
+                yield {"event": "done", "data": {"id": msg_id, "chat_response": chat_response}}
+            else:
+                yield {"event": "done", "data": {"chat_response": chat_response}}
+        except Exception as e:
+            yield {"event": "error", "data": {"error": f"An unexpected error occurred while creating a message: {str(e)}"}}
+
+    def _create_llm(self, model_name: str) -> OllamaLLM:
+        return OllamaLLM(model=model_name, 
+                         num_predict=int(self.max_tokens), 
+                         temperature=float(self.temperature), 
+                         top_k=int(self.top_k), 
+                         top_p=float(self.top_p),
+                         keep_alive=ModelResidencyManager().keep_alive_for(model_name))
+
     async def retrieve_message(self, id:str) -> Optional[MessageSchema]:
         async with db_session_context() as session:            
             result = await session.execute(select(Message).filter(Message.id == id))
@@ -123,6 +167,7 @@ class MessagesManager:
             msgs = result.scalars().all()
             msgs = [MessageSchema.from_orm(msg) for msg in msgs]
             print("msgs: ", msgs)
+            RagManager().invalidate_chat_history(conversation_id)
             for msg in msgs:
                 if not await self._delete_message(msg.id):
                     return False
@@ -141,4 +186,6 @@ class MessagesManager:
             session.add(new_message)
             await session.commit()
             await session.refresh(new_message)
-            return new_message.id, None
\ No newline at end of file
+        if new_message.conversation_id:
+            RagManager().append_chat_history(new_message.conversation_id, new_message.prompt, new_message.chat_response)
+        return new_message.id, None
\ No newline at end of file
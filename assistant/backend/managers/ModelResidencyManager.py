@@ -0,0 +1,244 @@
+import re
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from threading import Lock
+from typing import AsyncIterator, Dict, List, Optional
+import httpx
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased
+from backend.models import Resource, Message
+from backend.db import db_session_context
+from common.utils import get_env_key
+
+logger = logging.getLogger(__name__)
+
+def parse_duration(value: str) -> int:
+    # Seconds in a duration like "90", "-1", "30m" or "1h30m"
+    value = value.strip()
+    if value.lstrip('-').isdigit():
+        return int(value)
+    parts = re.fullmatch(r"(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?", value)
+    if not value or not parts:
+        raise ValueError(f"Invalid duration: {value!r}")
+    hours, minutes, seconds = (int(part or 0) for part in parts.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+def model_key(model: str) -> str:
+    # Ollama reports models with their tag; a name without one means the latest
+    return model if ':' in model else f"{model}:latest"
+
+class ModelResidencyManager:
+    # Keeps track of which Ollama models are loaded against a RAM budget. Models are loaded ahead of the
+    # requests that need them, and when a model doesn't fit, the least recently used models that no request
+    # is using are unloaded first. Pinned models (the embedder) are never unloaded.
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            with cls._lock:
+                if not cls._instance:
+                    cls._instance = super(ModelResidencyManager, cls).__new__(cls, *args, **kwargs)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, '_initialized'):
+            with self._lock:
+                if not hasattr(self, '_initialized'):
+                    self._initialized = True
+                    self.base_url = get_env_key('OLLAMA_BASE_URL', 'http://localhost:11434')
+                    self.ram_budget = int(get_env_key('OLLAMA_RAM_BUDGET', 8589934592))
+                    self.load_timeout = float(get_env_key('OLLAMA_LOAD_TIMEOUT', 300))
+                    # keep_alive per model as "model=duration,..." (Ollama durations, -1 to keep a model loaded)
+                    self.default_keep_alive = parse_duration(get_env_key('OLLAMA_KEEP_ALIVE', '30m'))
+                    self.pinned_keep_alive = parse_duration(get_env_key('OLLAMA_PINNED_KEEP_ALIVE', '-1'))
+                    self.keep_alive_overrides = self._parse_keep_alive(get_env_key('OLLAMA_KEEP_ALIVE_MODELS', ''))
+                    self.pinned = set()
+                    self._resident = OrderedDict()  # model -> bytes in memory, least recently used first
+                    self._sizes = {}  # model -> estimated bytes once loaded
+                    self._loading = {}  # model -> bytes set aside for it while it loads
+                    self._in_use = {}
+                    self._loop_locks = None
+                    self.loads = 0
+                    self.evictions = 0
+
+    def _parse_keep_alive(self, value: str) -> Dict[str, int]:
+        overrides = {}
+        for item in filter(None, (item.strip() for item in value.split(','))):
+            model, _, keep_alive = item.partition('=')
+            overrides[model_key(model.strip())] = parse_duration(keep_alive)
+        return overrides
+
+    def keep_alive_for(self, model: str) -> int:
+        # In seconds, which both Ollama and the LangChain clients accept; -1 keeps the model loaded
+        model = model_key(model)
+        if model in self.keep_alive_overrides:
+            return self.keep_alive_overrides[model]
+        return self.pinned_keep_alive if model in self.pinned else self.default_keep_alive
+
+    def pin(self, model: str):
+        self.pinned.add(model_key(model))
+
+    def _get_lock(self, model: Optional[str] = None) -> asyncio.Lock:
+        # The lock over the RAM budget, or the one for loading the given model. Locks are per event loop,
+        # so the singleton also works across asyncio.run calls
+        loop = asyncio.get_running_loop()
+        if self._loop_locks is None or self._loop_locks[0] is not loop:
+            self._loop_locks = (loop, asyncio.Lock(), {})
+        _, budget_lock, model_locks = self._loop_locks
+        if model is None:
+            return budget_lock
+        return model_locks.setdefault(model, asyncio.Lock())
+
+    @asynccontextmanager
+    async def use(self, model: str, embedding: bool = False) -> AsyncIterator[None]:
+        # Makes sure the model is loaded and keeps it from being evicted while the block runs
+        model = model_key(model)
+        self._in_use[model] = self._in_use.get(model, 0) + 1
+        try:
+            try:
+                await self.ensure_loaded(model, embedding)
+            except httpx.HTTPError as e:
+                # The request itself still gets to try; Ollama loads the model on demand
+                logger.warning(f"Could not preload model {model}: {e}")
+            yield
+        finally:
+            self._in_use[model] -= 1
+            if not self._in_use[model]:
+                del self._in_use[model]
+
+    async def ensure_loaded(self, model: str, embedding: bool = False, evict: bool = True) -> bool:
+        # Resident models return right away. Otherwise requests for the same model wait for a single load,
+        # and only making room in the budget is serialized, so loading one model doesn't hold up the others
+        model = model_key(model)
+        if model in self._resident:
+            self._resident.move_to_end(model)
+            return True
+        async with self._get_lock(model):
+            if model in self._resident:
+                self._resident.move_to_end(model)
+                return True
+            async with self._get_lock():
+                await self._refresh()
+                if model in self._resident:
+                    self._resident.move_to_end(model)
+                    return True
+                size = await self._estimated_size(model)
+                if not await self._make_room(size, evict):
+                    if not evict:
+                        return False
+                    logger.warning(f"Loading {model} ({size} bytes) exceeds the RAM budget of {self.ram_budget} bytes")
+                self._loading[model] = size
+            try:
+                await self._load(model, embedding)
+            finally:
+                self._loading.pop(model, None)
+            async with self._get_lock():
+                await self._refresh()
+                self._resident.setdefault(model, size)
+                self._resident.move_to_end(model)
+            return True
+
+    async def warm_up(self, embedder: Optional[str] = None):
+        # Loads the embedder and the LLMs of the assistants that were used most recently, as long as they fit
+        # in the budget without evicting each other
+        try:
+            if embedder:
+                self.pin(embedder)
+                await self.ensure_loaded(embedder, embedding=True, evict=False)
+            for model in await self._active_models():
+                if not await self.ensure_loaded(model, evict=False):
+                    logger.info(f"Warm-up stopped at {model}: RAM budget reached")
+                    break
+            logger.info(f"Warm-up done, resident models: {self.stats()}")
+        except httpx.HTTPError as e:
+            logger.warning(f"Model warm-up failed: {e}")
+
+    async def evict(self, model: str):
+        model = model_key(model)
+        async with self._get_lock():
+            await self._unload(model)
+
+    async def _make_room(self, size: int, evict: bool) -> bool:
+        for model in list(self._resident):
+            if self._ram_used() + size <= self.ram_budget:
+                break
+            if not evict or model in self.pinned or model in self._in_use or model in self._loading:
+                continue
+            await self._unload(model)
+        return self._ram_used() + size <= self.ram_budget
+
+    def _ram_used(self) -> int:
+        # Models still loading count too; Ollama may already report them as running
+        return sum(self._resident.values()) + sum(size for model, size in self._loading.items() if model not in self._resident)
+
+    async def _load(self, model: str, embedding: bool):
+        # An empty request loads the model and sets how long Ollama keeps it after the last request
+        payload = {"model": model, "keep_alive": self.keep_alive_for(model)}
+        if embedding:
+            payload["input"] = []
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.load_timeout) as client:
+            response = await client.post("/api/embed" if embedding else "/api/generate", json=payload)
+            response.raise_for_status()
+        self.loads += 1
+        logger.info(f"Loaded model {model} (keep_alive {payload['keep_alive']})")
+
+    async def _unload(self, model: str):
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.load_timeout) as client:
+            response = await client.post("/api/generate", json={"model": model, "keep_alive": 0})
+            response.raise_for_status()
+        self._resident.pop(model, None)
+        self.evictions += 1
+        logger.info(f"Unloaded model {model}")
+
+    async def _refresh(self):
+        # Ollama also unloads models on its own once their keep_alive runs out, so resync with what it reports
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.load_timeout) as client:
+            response = await client.get("/api/ps")
+            response.raise_for_status()
+        running = {model_key(model["name"]): model.get("size", 0) for model in response.json().get("models", [])}
+        resident = OrderedDict((model, size) for model, size in running.items() if model not in self._resident)
+        for model in self._resident:
+            if model in running:
+                resident[model] = running[model]
+        self._resident = resident
+        self._sizes.update(running)
+
+    async def _estimated_size(self, model: str) -> int:
+        # What the model took when it was last loaded, otherwise its size on disk
+        if model not in self._sizes:
+            async with httpx.AsyncClient(base_url=self.base_url, timeout=self.load_timeout) as client:
+                response = await client.get("/api/tags")
+                response.raise_for_status()
+            for entry in response.json().get("models", []):
+                self._sizes.setdefault(model_key(entry["name"]), entry.get("size", 0))
+        return self._sizes.get(model, 0)
+
+    async def _active_models(self) -> List[str]:
+        # LLMs of the assistants, the ones with the most recent messages first
+        llm = aliased(Resource)
+        last_message = func.max(Message.timestamp)
+        stmt = (select(llm.uri, last_message)
+                .select_from(Resource)
+                .join(llm, llm.id == Resource.resource_llm_id)
+                .outerjoin(Message, Message.assistant_id == Resource.id)
+                .filter(Resource.kind == "assistant")
+                .group_by(llm.uri)
+                .order_by(last_message.desc().nulls_last()))
+        async with db_session_context() as session:
+            rows = (await session.execute(stmt)).all()
+        return list(dict.fromkeys(model_key(uri.split('/')[-1]) for uri, _ in rows))
+
+    def stats(self) -> dict:
+        return {
+            "resident": dict(self._resident),
+            "loading": dict(self._loading),
+            "in_use": dict(self._in_use),
+            "pinned": sorted(self.pinned),
+            "ram_used": self._ram_used(),
+            "ram_budget": self.ram_budget,
+            "loads": self.loads,
+            "evictions": self.evictions
+        }
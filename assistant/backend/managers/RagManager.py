@@ -1,34 +1,58 @@
 from threading import Lock
 from backend.schemas import FileSchema
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import chromadb
+from chromadb.errors import NotFoundError
 from langchain_chroma import Chroma
 from langchain_ollama import OllamaEmbeddings
-from common.paths import chroma_db_path
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from common.paths import chroma_db_path, embedding_cache_path, uploads_dir
 from pathlib import Path
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_retrieval_chain, create_history_aware_retriever
+from langchain.chains import create_retrieval_chain
 import shutil
 from starlette.datastructures import UploadFile
 from uuid import uuid4
-from backend.models import File, Page, Chunk
+from backend.models import File, Page, Chunk, Message
 from backend.db import db_session_context
-from sqlalchemy import delete, select, func
+from sqlalchemy import delete, insert, select, update, func, text
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict, Any, Union
+from typing import AsyncIterator, List, Tuple, Optional, Dict, Any, Union
 from backend.managers import ResourcesManager, PersonasManager
+from backend.managers.ModelResidencyManager import ModelResidencyManager
 from distutils.util import strtobool
 import os
 import logging
 from enum import Enum
-import aiofiles
+import io
+import mmap
+import contextlib
 import asyncio
+import hashlib
+import time
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 from common.paths import base_dir
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from collections import deque
 from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.runnables import RunnableBranch, RunnableConfig, RunnableLambda
+from langchain_core.output_parsers import StrOutputParser
 from common.utils import get_env_key
+from backend.utils import get_current_rss
+from backend.embeddings import EmbeddingCache, CachedEmbeddings, BatchedEmbeddings, text_hash, normalize_query
+from backend.cache import LRUCache, AnswerCache
+from backend.pdf import load_pdf, count_pdf_pages
+from backend.ingestion import FileProgress, StageQueue, find_bottleneck, run_stages
+from backend.text_splitter import OffsetTextSplitter
+from backend.rephrase import needs_rephrase, query_overlap
+from backend.retrievers import HybridRetriever, is_keyword_lookup, add_chunk_texts, delete_chunk_texts, set_chunk_texts_page
+from backend.context import PackedRetriever, PromptStatsHandler
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +65,37 @@ class FileStatus(Enum):
     DONE = 'done'
     FAILED = 'failed'
 
+def _upload_buffer(source) -> Optional[Union[memoryview, mmap.mmap]]:
+    # Exposes the bytes of an upload's spooled temp file without copying them: the in-memory buffer
+    # while the upload is small, a read-only memory map once it has rolled over to disk
+    source = getattr(source, '_file', source)  # SpooledTemporaryFile wraps a BytesIO or a real temp file
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer()
+    try:
+        source.flush()
+        if os.fstat(source.fileno()).st_size == 0:
+            return memoryview(b'')
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+def _write_upload(source, path: Path, read_size: int) -> str:
+    # Writes the upload to path with a single write and hashes the same buffer, falling back
+    # to large sequential reads for file objects that can't be mapped
+    sha256 = hashlib.sha256()
+    source.seek(0)
+    buffer = _upload_buffer(source)
+    with open(path, 'wb') as out_file:
+        if buffer is not None:
+            with buffer:
+                sha256.update(buffer)
+                out_file.write(buffer)
+        else:
+            while content := source.read(read_size):
+                sha256.update(content)
+                out_file.write(content)
+    return sha256.hexdigest()
+
 class RagManager:
     _instance = None
     _lock = Lock()
@@ -61,63 +116,364 @@ class RagManager:
                     self.chunk_overlap = get_env_key('CHUNK_OVERLAP', 400)
                     self.add_start_index = get_env_key('ADD_START_INDEX', 'True')
                     self.embedder_model = get_env_key('EMBEDDER_MODEL', 'llama3:latest')
+                    self.chroma_db_path = chroma_db_path
                     self.system_prompt = get_env_key('SYSTEM_PROMPT',"You are a helpful assistant for students learning needs.")
+                    self.index_batch_pages = int(get_env_key('INDEX_BATCH_PAGES', 50))
+                    # Read size used when an upload can't be memory mapped
+                    self.upload_read_size = int(get_env_key('UPLOAD_READ_SIZE', 1048576))
+                    # Each ingestion stage has its own concurrency limit; PDF parsing is CPU bound and runs in a process pool
+                    self.index_parse_workers = int(get_env_key('INDEX_PARSE_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+                    self._parse_executor = None
+                    self._parse_semaphore = asyncio.Semaphore(self.index_parse_workers)
+                    self._split_semaphore = asyncio.Semaphore(int(get_env_key('INDEX_SPLIT_CONCURRENCY', 2)))
+                    self._store_semaphore = asyncio.Semaphore(int(get_env_key('INDEX_STORE_CONCURRENCY', 1)))
+                    self._embed_semaphore = asyncio.Semaphore(int(get_env_key('INDEX_EMBED_CONCURRENCY', 4)))
+                    # Streaming mode reads PDFs page by page; embeddings are flushed in windows of about index_flush_chunks chunks
+                    self.index_streaming = bool(strtobool(get_env_key('INDEX_STREAMING', 'False')))
+                    self.index_flush_chunks = int(get_env_key('INDEX_FLUSH_CHUNKS', 256))
+                    # High-water marks, in batches of index_batch_pages pages, of the queues in front of each stage
+                    self.index_split_queue_size = int(get_env_key('INDEX_SPLIT_QUEUE_SIZE', 2))
+                    self.index_store_queue_size = int(get_env_key('INDEX_STORE_QUEUE_SIZE', 2))
+                    self.index_embed_queue_size = int(get_env_key('INDEX_EMBED_QUEUE_SIZE', 2))
+                    # Metrics of the most recently finished ingestions, by file id
+                    self.ingestion_metrics = LRUCache(int(get_env_key('INGESTION_METRICS_HISTORY', 64)))
+                    # Live progress of files being indexed, written to their File rows every few seconds
+                    self.index_progress_interval = float(get_env_key('INDEX_PROGRESS_INTERVAL', 2))
+                    self.progress = {}
+                    # Chunk embeddings are cached on disk across indexing runs and assistants
+                    self.embedding_cache_max_entries = int(get_env_key('EMBEDDING_CACHE_MAX_ENTRIES', 100000))
+                    self._embedding_cache = None
+                    # Embedding requests are batched, with the batch size adapted to observed latency and errors
+                    self.embed_batch_size = int(get_env_key('EMBED_BATCH_SIZE', 32))
+                    self.embed_max_batch_size = int(get_env_key('EMBED_MAX_BATCH_SIZE', 256))
+                    self.embed_target_latency = float(get_env_key('EMBED_TARGET_LATENCY', 30))
+                    self.embed_max_retries = int(get_env_key('EMBED_MAX_RETRIES', 3))
+                    self._batched_embeddings = None
+                    self._embeddings = None
+                    # Query embeddings are cached in memory so repeated questions skip the embedder
+                    self._query_embeddings = LRUCache(int(get_env_key('QUERY_EMBEDDING_CACHE_SIZE', 1024)),
+                                                      ttl=float(get_env_key('QUERY_EMBEDDING_CACHE_TTL', 3600)))
+                    # The last chat_history_window turns of recently active conversations, appended as messages are saved
+                    self.chat_history_window = int(get_env_key('CHAT_HISTORY_WINDOW', 10))
+                    self._chat_histories = LRUCache(int(get_env_key('CHAT_HISTORY_CACHE_SIZE', 256)))
+                    # When follow-up questions are rewritten into standalone ones before retrieval: 'auto' only
+                    # rewrites questions that look like they depend on the history, 'always' and 'never' do what they say
+                    self.rephrase_policy = get_env_key('REPHRASE_POLICY', 'auto')
+                    # While a question is rewritten, the original is searched for speculatively; the results are kept when
+                    # the rewritten question shares at least speculative_overlap of its words with the original
+                    self.speculative_retrieval = bool(strtobool(get_env_key('SPECULATIVE_RETRIEVAL', 'True')))
+                    self.speculative_overlap = float(get_env_key('SPECULATIVE_OVERLAP', 0.8))
+                    self.rephrase_counts = {"performed": 0, "skipped_no_history": 0, "skipped_by_gate": 0,
+                                            "speculative_used": 0, "speculative_discarded": 0}
+                    # Answers to first questions, per assistant, persona and model; dropped whenever the assistant's index changes.
+                    # Only questions asked again are answered from it, unless both a sentence-embedding model and a similarity
+                    # threshold tuned for it are configured: then similar questions reuse answers too
+                    self.answer_cache_enabled = bool(strtobool(get_env_key('ANSWER_CACHE_ENABLED', 'True')))
+                    self.answer_cache_embedder_model = get_env_key('ANSWER_CACHE_EMBEDDER_MODEL', '')
+                    similarity = get_env_key('ANSWER_CACHE_SIMILARITY', '')
+                    self._answers = AnswerCache(int(get_env_key('ANSWER_CACHE_SIZE', 512)),
+                                                similarity=float(similarity) if similarity and self.answer_cache_embedder_model else None,
+                                                ttl=float(get_env_key('ANSWER_CACHE_TTL', 86400)))
+                    self._answer_embeddings = None
+                    # Chunks are retrieved by fusing BM25 over their text with vector similarity; short keyword
+                    # lookups (a code, name or quoted phrase) with enough lexical matches skip the embedder altogether
+                    self.hybrid_retrieval = bool(strtobool(get_env_key('HYBRID_RETRIEVAL', 'True')))
+                    self.retrieval_k = int(get_env_key('RETRIEVAL_K', 4))
+                    self.hybrid_fetch_k = int(get_env_key('HYBRID_FETCH_K', 20))
+                    self.hybrid_rrf_k = int(get_env_key('HYBRID_RRF_K', 60))
+                    self.lexical_max_words = int(get_env_key('LEXICAL_FAST_PATH_MAX_WORDS', 3))
+                    # Retrieved chunks below the relevance threshold (0-1, empty for none) are dropped: vector matches by
+                    # their relevance score and keyword matches by the share of the question's words they contain. The
+                    # rest are merged where they overlap and packed into at most context_token_budget tokens (0 for no limit)
+                    score_threshold = get_env_key('RETRIEVAL_SCORE_THRESHOLD', '')
+                    self.retrieval_score_threshold = float(score_threshold) if score_threshold else None
+                    self.context_token_budget = int(get_env_key('CONTEXT_TOKEN_BUDGET', 1536))
+                    self._prompt_stats = PromptStatsHandler()
+                    self._chunk_texts_checked = set()
+                    # Open Chroma collections, so their wrappers are reused between requests. Their indexes stay loaded
+                    # in the client until it is closed, so once the estimated size of the collections opened on it passes
+                    # chroma_memory_limit (0 for no limit), the client is closed and collections reopen on a fresh one
+                    self._chroma_client = None
+                    self.chroma_memory_limit = int(get_env_key('CHROMA_MEMORY_LIMIT_BYTES', 1073741824))
+                    self._vectorstores = LRUCache(int(get_env_key('CHROMA_CACHE_MAX_COLLECTIONS', 32)))
+                    self._footprints = {}  # collection name -> estimated bytes, for the collections opened on the client
+                    self._handed_out = weakref.WeakSet()  # wrappers of the client that may still be in use
+                    self._chroma_lock = Lock()
+                    self.chroma_client_releases = 0
                     print("params:::", self.chunk_size, self.chunk_overlap, self.add_start_index, self.embedder_model, self.system_prompt)           
     
     async def create_index(self, resource_id: str, path_files: List[str], files_ids:List[str]) -> List[dict]:
-        loop = asyncio.get_running_loop()        
-        text_splitter = RecursiveCharacterTextSplitter(
+        vectorstore = await self.initialize_chroma(resource_id) 
+        self.invalidate_answers(resource_id)
+
+        # Files move through the parse, split, store and embed stages independently, so one
+        # file can be embedding while another is still being parsed
+        results = await asyncio.gather(
+            *[self._index_file(resource_id, path, file_id, vectorstore) for path, file_id in zip(path_files, files_ids)],
+            return_exceptions=True
+        )
+
+        # The collection has grown. Answers given while the files were being indexed may be missing their content
+        await self._refresh_footprint(resource_id)
+        self.invalidate_answers(resource_id)
+
+        file_info_list = []
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+            file_info_list.extend(result)
+        return file_info_list
+
+    async def _index_file(self, resource_id: str, path: str, file_id: str, vectorstore) -> List[dict]:
+        progress = self._start_progress(file_id)
+        try:
+            # A file resumed after a crash picks up after its checkpoint; the pages up to it are already indexed
+            pages = await self._resume_from_checkpoint(file_id, progress)
+            await progress.set_stage(FileStatus.SPLITTING.value)
+            # Streaming mode reads the PDF page by page instead of parsing it whole in the process pool
+            batches = self._stream_pdf_batches(path, progress) if self.index_streaming else self._load_pdf_batches(path, progress)
+            if progress.checkpoint_page is not None:
+                batches = self._pages_after(batches, progress.checkpoint_page)
+            pages += await self._run_pipeline(resource_id, file_id, batches, vectorstore, progress, checkpoint=True)
+            await progress.set_stage(FileStatus.DONE.value)
+        except Exception as e:
+            # Update status to 'failed' if an error occurs
+            await progress.set_stage(FileStatus.FAILED.value)
+            raise e
+        finally:
+            await progress.close()
+            self.progress.pop(file_id, None)
+
+        file_name = Path(path).name
+        return [{"file_id": file_id, "file_name": file_name, "page_id": page_id} for page_id in pages]
+
+    async def _run_pipeline(self, resource_id: str, file_id: str, batches: AsyncIterator[List[Document]], vectorstore,
+                            progress: FileProgress, checkpoint: bool = False) -> List[str]:
+        # Batches of pages flow through the parse, split, store and embed stages, which run concurrently and are
+        # connected by bounded queues, so memory is capped by the queue sizes and the slowest stage sets the pace
+        metrics = self._start_ingestion_metrics(file_id)
+        queues = [StageQueue('split', self.index_split_queue_size),
+                  StageQueue('store', self.index_store_queue_size),
+                  StageQueue('embed', self.index_embed_queue_size)]
+        page_ids = []
+        try:
+            await run_stages(
+                self._parse_stage(batches, queues[0]),
+                self._split_stage(resource_id, file_id, queues[0], queues[1]),
+                self._store_stage(queues[1], queues[2], page_ids, metrics, progress),
+                self._embed_stage(vectorstore, queues[2], metrics, progress, checkpoint)
+            )
+        finally:
+            metrics["queues"] = {queue.name: queue.stats() for queue in queues}
+            metrics["bottleneck"] = find_bottleneck(['parse', 'split', 'store', 'embed'], queues)
+            self._log_ingestion_metrics(file_id, metrics)
+        return page_ids
+
+    async def _load_pdf_batches(self, path: str, progress: FileProgress) -> AsyncIterator[List[Document]]:
+        # Parse the PDF in the process pool
+        loop = asyncio.get_running_loop()
+        async with self._parse_semaphore:
+            docs = await loop.run_in_executor(self._get_parse_executor(), load_pdf, path)
+        progress.pages_total = len(docs)
+        async for batch in self._doc_batches(docs):
+            yield batch
+
+    async def _stream_pdf_batches(self, path: str, progress: FileProgress) -> AsyncIterator[List[Document]]:
+        # Pages are pulled lazily from the PDF, so only the pages waiting in the queues are held in memory
+        loop = asyncio.get_running_loop()
+        progress.pages_total = await loop.run_in_executor(None, count_pdf_pages, path)
+        pages_iter = PyPDFLoader(path).lazy_load()
+        batch = []
+        while True:
+            async with self._parse_semaphore:
+                doc = await loop.run_in_executor(None, next, pages_iter, None)
+            if doc is None:
+                break
+            batch.append(doc)
+            if len(batch) >= self.index_batch_pages:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def _parse_stage(self, batches: AsyncIterator[List[Document]], output: StageQueue):
+        async for docs in batches:
+            await output.put(docs)
+        await output.close()
+
+    async def _split_stage(self, resource_id: str, file_id: str, input: StageQueue, output: StageQueue):
+        # Split the pages into smaller chunks
+        loop = asyncio.get_running_loop()
+        while (docs := await input.get()) is not None:
+            async with self._split_semaphore:
+                pages = await loop.run_in_executor(None, self._split_pages, docs, resource_id, file_id)
+            await output.put(pages)
+        await output.close()
+
+    async def _store_stage(self, input: StageQueue, output: StageQueue, page_ids: List[str], metrics: dict, progress: FileProgress):
+        # Write the page and chunk rows in bulk, one transaction per batch
+        while (pages := await input.get()) is not None:
+            async with self._store_semaphore:
+                await self._store_pages(pages, metrics)
+            page_ids.extend(page["row"]["id"] for page in pages)
+            await progress.advance(pages=len(pages), chunks=sum(len(page["splits"]) for page in pages))
+            self._sample_rss(metrics)
+            await output.put(pages)
+        await output.close()
+
+    async def _embed_stage(self, vectorstore, input: StageQueue, metrics: dict, progress: FileProgress, checkpoint: bool):
+        # Add the split documents to the vectorstore in windows of about index_flush_chunks chunks. Windows are
+        # embedded in page order after their rows are stored, so once one is in Chroma every page up to its last is durable
+        window = []
+        while (pages := await input.get()) is not None:
+            if progress.stage != FileStatus.INDEXING.value:
+                await progress.set_stage(FileStatus.INDEXING.value)
+            window.extend(pages)
+            if sum(len(page["splits"]) for page in window) >= self.index_flush_chunks:
+                await self._embed_window(vectorstore, window, metrics, progress)
+                if checkpoint:
+                    progress.checkpoint(window[-1]["row"]["page_number"])
+                window = []
+            self._sample_rss(metrics)
+        await self._embed_window(vectorstore, window, metrics, progress)
+        if checkpoint and window:
+            progress.checkpoint(window[-1]["row"]["page_number"])
+
+    async def _resume_from_checkpoint(self, file_id: str, progress: FileProgress) -> List[str]:
+        # Seeds progress from a previous interrupted run and returns the ids of the pages it already indexed.
+        # Reads the row directly, retrieve_file would overlay the fresh in-memory progress
+        async with db_session_context() as session:
+            file = (await session.execute(select(File).filter(File.id == file_id))).scalar_one_or_none()
+        if not file or file.checkpoint_page is None:
+            return []
+        progress.checkpoint_page = file.checkpoint_page
+        progress.pages_processed = file.pages_processed
+        progress.chunks_total = file.chunks_total
+        progress.chunks_embedded = file.chunks_embedded
+        logger.info(f"Resuming indexing of file {file_id} after page {file.checkpoint_page}")
+        return [page.id for page in await self.retrieve_pages(file_id)]
+
+    async def _pages_after(self, batches: AsyncIterator[List[Document]], page: int) -> AsyncIterator[List[Document]]:
+        async for docs in batches:
+            docs = [doc for doc in docs if doc.metadata.get("page", 0) > page]
+            if docs:
+                yield docs
+
+    async def _embed_window(self, vectorstore, pages: List[dict], metrics: dict, progress: FileProgress):
+        if not pages:
+            return
+        async with self._embed_semaphore:
+            start = time.perf_counter()
+            await self._embed_pages(vectorstore, pages)
+            metrics["vector_time"] += time.perf_counter() - start
+        await progress.advance(embedded=sum(len(page["splits"]) for page in pages))
+
+    async def _store_pages(self, pages: List[dict], metrics: dict):
+        start = time.perf_counter()
+        metrics["rows"] += await self.create_pages_and_chunks(
+            [page["row"] for page in pages],
+            [row for page in pages for row in page["chunk_rows"]],
+            [self._chunk_text_row(row, split) for page in pages for row, split in zip(page["chunk_rows"], page["splits"])]
+        )
+        metrics["db_time"] += time.perf_counter() - start
+
+    def _chunk_text_row(self, chunk_row: dict, split: Document) -> dict:
+        return {"text": split.page_content, "chunk_id": chunk_row["id"], "assistant_id": chunk_row["assistant_id"],
+                "file_id": chunk_row["file_id"], "page_id": chunk_row["page_id"],
+                "page_number": split.metadata.get("page"), "start_index": split.metadata.get("start_index")}
+
+    async def _embed_pages(self, vectorstore, pages: List[dict]):
+        loop = asyncio.get_running_loop()
+        split_documents = [split for page in pages for split in page["splits"]]
+        split_ids = [row["id"] for page in pages for row in page["chunk_rows"]]
+        if split_documents:
+            write = loop.run_in_executor(None, lambda: vectorstore.add_documents(documents=split_documents, ids=split_ids))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # The write carries on in its thread regardless. Wait for it, even if cancelled again (run_stages
+                # cancels every stage), so a resumed run's rollback doesn't miss vectors that land after it
+                while not write.done():
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await asyncio.wait([write])
+                raise
+
+    def _get_text_splitter(self) -> OffsetTextSplitter:
+        return OffsetTextSplitter(
             chunk_size=int(self.chunk_size),
             chunk_overlap=int(self.chunk_overlap),
             add_start_index=bool(strtobool(self.add_start_index))
         )
-        file_info_list = []
-        vectorstore = await self.initialize_chroma(resource_id) 
-        
-        for path, file_id in zip(path_files, files_ids):
-            file_name = Path(path).name
-            
-            try:
-                # Load the PDF
-                loader = PyPDFLoader(path)
-                
-                docs = await loop.run_in_executor(None, loader.load)  # Load all pages at once
-                split_documents = []
-                split_ids = []
-                
-                # Process each page in the PDF
-                for doc in docs:
-                    page_id = str(uuid4())  # Unique ID for each page
-                    file_info_list.append({"file_id": file_id, "file_name": file_name, "page_id": page_id})
-                    
-                    await self.update_file_status(file_id, FileStatus.SPLITTING.value)
-                    # Split the document into smaller chunks
-                    splits = text_splitter.split_documents([doc])
-                    await self.create_page(page_id, file_id, resource_id)
-                    
-                    for split in splits:
-                        chunk_id = str(uuid4())  # Unique ID for each chunk
-                        await self.create_chunk(chunk_id, page_id, file_id, resource_id)
-                        split.metadata["original_id"] = page_id
-                        split_documents.append(split)
-                        split_ids.append(chunk_id)
-                    
-                    # Update status to 'split' after splitting
-                    await self.update_file_status(file_id, FileStatus.SPLIT.value)
-
-                # Add the split documents to the vectorstore and update status to 'indexing'
-                await self.update_file_status(file_id, FileStatus.INDEXING.value)
-                await loop.run_in_executor(None, lambda: vectorstore.add_documents(documents=split_documents, ids=split_ids))
-                
-                # Update status to 'done' once indexing is complete
-                await self.update_file_status(file_id, FileStatus.DONE.value)
 
-            except Exception as e:
-                # Update status to 'failed' if an error occurs
-                await self.update_file_status(file_id, FileStatus.FAILED.value)
-                raise e
+    def _split_pages(self, docs: List[Document], resource_id: str, file_id: str) -> List[dict]:
+        text_splitter = self._get_text_splitter()
+        return [self._split_page(doc, resource_id, file_id, text_splitter) for doc in docs]
+
+    def _split_page(self, doc: Document, resource_id: str, file_id: str, text_splitter) -> dict:
+        page_id = str(uuid4())  # Unique ID for each page
+        splits = text_splitter.split_documents([doc])
+        chunk_rows = []
+        for split in splits:
+            chunk_id = str(uuid4())  # Unique ID for each chunk
+            chunk_rows.append({"id": chunk_id, "page_id": page_id, "file_id": file_id, "assistant_id": resource_id})
+            split.metadata["original_id"] = page_id
+        return {
+            "row": {"id": page_id, "file_id": file_id, "assistant_id": resource_id,
+                    "page_number": doc.metadata.get("page"), "content_hash": text_hash(doc.page_content)},
+            "chunk_rows": chunk_rows,
+            "splits": splits
+        }
+
+    def _start_progress(self, file_id: str) -> FileProgress:
+        progress = FileProgress(file_id, self.update_file, self.index_progress_interval)
+        self.progress[file_id] = progress
+        return progress
+
+    def _start_ingestion_metrics(self, file_id: str) -> dict:
+        metrics = {"rows": 0, "db_time": 0.0, "vector_time": 0.0, "process_start_rss": get_current_rss()}
+        metrics["process_peak_rss"] = metrics["process_start_rss"]
+        return metrics
+
+    def _sample_rss(self, metrics: dict):
+        # RSS is process-wide: the peak seen during the job includes other jobs running at the same time,
+        # so only its growth since the job started says something about the job itself
+        metrics["process_peak_rss"] = max(metrics["process_peak_rss"], get_current_rss())
 
-        return file_info_list   
+    def _log_ingestion_metrics(self, file_id: str, metrics: dict):
+        rate = metrics["rows"] / metrics["db_time"] if metrics["db_time"] > 0 else 0.0
+        metrics["rows_per_sec"] = rate
+        logger.info(f"Persisted {metrics['rows']} page/chunk rows for file {file_id} in {metrics['db_time']:.3f}s ({rate:.0f} rows/s)")
+        logger.info(f"Embedded and stored vectors for file {file_id} in {metrics['vector_time']:.3f}s")
+        if "queues" in metrics:
+            logger.info(f"Ingestion queues for file {file_id}: {metrics['queues']} (bottleneck: {metrics['bottleneck']})")
+        metrics["process_rss_growth"] = metrics["process_peak_rss"] - metrics["process_start_rss"]
+        logger.info(f"Process RSS peaked at {metrics['process_peak_rss'] / 2**20:.1f} MiB while file {file_id} was ingested "
+                    f"({metrics['process_rss_growth'] / 2**20:+.1f} MiB since it started, including concurrent jobs)")
+        self.ingestion_metrics.put(file_id, metrics)
+        if self._embedding_cache is not None:
+            logger.info(f"Embedding cache: {self._embedding_cache.stats()}")
+        if self._batched_embeddings is not None:
+            logger.info(f"Embedding batches: {self._batched_embeddings.stats()}")
+
+    def _get_parse_executor(self) -> ProcessPoolExecutor:
+        # Workers are spawned rather than forked: forking a process that already runs threads (Chroma, the
+        # default executor) can leave locks held in the child and deadlock it
+        if self._parse_executor is None:
+            with self._lock:
+                if self._parse_executor is None:
+                    self._parse_executor = ProcessPoolExecutor(max_workers=self.index_parse_workers,
+                                                               mp_context=multiprocessing.get_context("spawn"))
+        return self._parse_executor
+
+    def shutdown(self):
+        # Stops the parse workers; queued parses are dropped, a parse already running finishes in its worker
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown(wait=False, cancel_futures=True)
+            self._parse_executor = None
+
+    async def update_file(self, file_id: str, **values):
+        async with db_session_context() as session:
+            await session.execute(update(File).where(File.id == file_id).values(**values))
 
     async def update_file_status(self, file_id: str, status: str):
         async with db_session_context() as session:
@@ -157,16 +513,184 @@ class RagManager:
             except Exception as e:                
                 print(f"An error occurred creating a chunk: {e}")
 
+
+    async def create_pages_and_chunks(self, pages: List[dict], chunks: List[dict], chunk_texts: List[dict] = ()) -> int:
+        # Bulk insert page and chunk rows, and the chunks' text for full-text search, in a single transaction
+        # (one commit instead of one per row)
+        if not pages and not chunks:
+            return 0
+        async with db_session_context() as session:
+            if pages:
+                await session.execute(insert(Page), pages)
+            if chunks:
+                await session.execute(insert(Chunk), chunks)
+            await add_chunk_texts(session, list(chunk_texts))
+        return len(pages) + len(chunks)
+
             
     async def initialize_chroma(self, collection_name: str):
-        embed = OllamaEmbeddings(model=self.embedder_model)
-        
-        path = Path(chroma_db_path)
-        vectorstore = Chroma(persist_directory=str(path),
+        # Open collections are kept in a process-wide registry instead of reopening the store on every request
+        vectorstore = self._vectorstores.get(collection_name)
+        if vectorstore is not None:
+            return vectorstore
+
+        loop = asyncio.get_running_loop()
+        footprint = await loop.run_in_executor(None, self._collection_footprint, collection_name)
+        if self.chroma_memory_limit > 0 and self._footprints and sum(self._footprints.values()) + footprint > self.chroma_memory_limit:
+            self._release_chroma_client()
+        embed = self._get_embeddings()
+        vectorstore = Chroma(client=self._get_chroma_client(),
                              collection_name=collection_name,
                              embedding_function=embed)
+        self._footprints[collection_name] = footprint
+        self._handed_out.add(vectorstore)
+        self._vectorstores.put(collection_name, vectorstore)
+        logger.info(f"Opened Chroma collection {collection_name}, open collections: {self.vectorstore_stats()}")
         return vectorstore
 
+    def _collection_footprint(self, collection_name: str) -> int:
+        # Rough size of a collection's HNSW index once loaded: a float32 vector plus graph links per record.
+        # Counting reads the metadata store only, so the index itself isn't loaded
+        with self._chroma_lock:
+            try:
+                collection = self._get_chroma_client().get_collection(collection_name)
+            except (NotFoundError, ValueError):
+                return 0
+            count = collection.count()
+            if not count:
+                return 0
+            embeddings = collection.get(limit=1, include=["embeddings"])["embeddings"]
+        dimensions = len(embeddings[0]) if embeddings is not None and len(embeddings) else 0
+        return count * (dimensions * 4 + 128)
+
+    async def _refresh_footprint(self, collection_name: str):
+        if collection_name in self._footprints:
+            self._footprints[collection_name] = await asyncio.get_running_loop().run_in_executor(
+                None, self._collection_footprint, collection_name)
+
+    def _release_chroma_client(self) -> bool:
+        # The Rust bindings only unload indexes when their client is closed. Closing it while a request still
+        # holds one of its collections would break that request, so until they are all let go the client stays
+        # open over the limit, and the next collection opened tries again
+        with self._chroma_lock:
+            registered = {id(vectorstore): name for name, vectorstore in self._vectorstores.items()}
+            self._vectorstores.clear()
+            in_use = list(self._handed_out)
+            if in_use:
+                for vectorstore in in_use:
+                    if id(vectorstore) in registered:
+                        self._vectorstores.put(registered[id(vectorstore)], vectorstore)
+                logger.info(f"Chroma collections over the memory limit are still in use: {self.vectorstore_stats()}")
+                return False
+            if self._chroma_client is not None:
+                self._chroma_client.close()
+            self._chroma_client = None
+            self._footprints.clear()
+            self.chroma_client_releases += 1
+            logger.info("Closed the Chroma client to unload its collections")
+            return True
+
+    def invalidate_vectorstore(self, collection_name: str):
+        # Called when a resource is deleted so its collection isn't held open
+        self._vectorstores.pop(collection_name)
+        self._footprints.pop(collection_name, None)
+        self.invalidate_answers(collection_name)
+
+    def invalidate_answers(self, resource_id: str):
+        self._answers.invalidate(resource_id)
+
+    def answer_cache_stats(self) -> dict:
+        return self._answers.stats()
+
+    def vectorstore_stats(self) -> dict:
+        return {**self._vectorstores.stats(),
+                "estimated_bytes": sum(self._footprints.values()),
+                "memory_limit": self.chroma_memory_limit,
+                "client_releases": self.chroma_client_releases}
+
+    def query_embedding_stats(self) -> dict:
+        return self._query_embeddings.stats()
+
+    def _get_chroma_client(self) -> chromadb.ClientAPI:
+        if self._chroma_client is None:
+            with self._lock:
+                if self._chroma_client is None:
+                    self._chroma_client = chromadb.PersistentClient(path=str(self.chroma_db_path))
+        return self._chroma_client
+
+    def _get_embeddings(self) -> CachedEmbeddings:
+        # Shared across vectorstores so the cache and the learned batch size persist between requests
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    # The embedder is needed for every query, so it is pinned in memory
+                    models = ModelResidencyManager()
+                    models.pin(self.embedder_model)
+                    self.configure_embeddings(OllamaEmbeddings(model=self.embedder_model, keep_alive=models.keep_alive_for(self.embedder_model)),
+                                              EmbeddingCache(embedding_cache_path, self.embedding_cache_max_entries))
+        return self._embeddings
+
+    def _get_answer_embeddings(self) -> OllamaEmbeddings:
+        # Questions are compared with their own model; the retrieval embedder doesn't tell apart different
+        # questions on the same topic well enough to reuse answers
+        if self._answer_embeddings is None:
+            with self._lock:
+                if self._answer_embeddings is None:
+                    model = self.answer_cache_embedder_model
+                    self._answer_embeddings = OllamaEmbeddings(model=model, keep_alive=ModelResidencyManager().keep_alive_for(model))
+        return self._answer_embeddings
+
+    def configure_embeddings(self, embedder: Embeddings, cache: EmbeddingCache):
+        # Wraps the embedder with batching and the embedding cache; the ingestion benchmark uses this to swap in a fake embedder
+        self._embedding_cache = cache
+        self._batched_embeddings = BatchedEmbeddings(
+            embedder,
+            batch_size=self.embed_batch_size,
+            max_batch_size=self.embed_max_batch_size,
+            target_latency=self.embed_target_latency,
+            max_retries=self.embed_max_retries
+        )
+        self._embeddings = CachedEmbeddings(self._batched_embeddings, cache, self.embedder_model, self._query_embeddings)
+
+    async def create_retriever(self, collection_name: str, vectorstore):
+        if self.hybrid_retrieval:
+            await self._backfill_chunk_texts(collection_name, vectorstore)
+            retriever = HybridRetriever(vectorstore=vectorstore, assistant_id=collection_name, k=self.retrieval_k,
+                                        fetch_k=self.hybrid_fetch_k, rrf_k=self.hybrid_rrf_k,
+                                        keyword_max_words=self.lexical_max_words, score_threshold=self.retrieval_score_threshold)
+        elif self.retrieval_score_threshold is not None:
+            retriever = vectorstore.as_retriever(search_type="similarity_score_threshold",
+                                                 search_kwargs={"k": self.retrieval_k, "score_threshold": self.retrieval_score_threshold})
+        else:
+            retriever = vectorstore.as_retriever(search_kwargs={"k": self.retrieval_k})
+        if self.context_token_budget > 0:
+            retriever = PackedRetriever(retriever=retriever, token_budget=self.context_token_budget)
+        return retriever
+
+    async def _backfill_chunk_texts(self, collection_name: str, vectorstore):
+        # Chunks indexed before the full-text index existed only have their text in Chroma; copy it over
+        # once per collection and process
+        if collection_name in self._chunk_texts_checked:
+            return
+        async with db_session_context() as session:
+            missing = (await session.execute(
+                text("SELECT id, page_id, file_id FROM chunk WHERE assistant_id = :assistant_id AND id NOT IN "
+                     "(SELECT chunk_id FROM chunk_fts WHERE assistant_id = :assistant_id)"),
+                {"assistant_id": collection_name})).all()
+            chunks = {chunk.id: chunk for chunk in missing}
+            chunk_ids = list(chunks)
+            for i in range(0, len(chunk_ids), 1000):
+                stored = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: vectorstore.get(ids=chunk_ids[i:i + 1000], include=["documents", "metadatas"]))
+                rows = [{"text": document, "chunk_id": chunk_id, "assistant_id": collection_name,
+                         "file_id": chunks[chunk_id].file_id, "page_id": chunks[chunk_id].page_id,
+                         "page_number": (metadata or {}).get("page"), "start_index": (metadata or {}).get("start_index")}
+                        for chunk_id, document, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])]
+                await add_chunk_texts(session, rows)
+            if missing:
+                logger.info(f"Added {len(missing)} chunks of {collection_name} to the full-text index")
+        self._chunk_texts_checked.add(collection_name)
+
     def create_history_aware_retriever(self, llm, retriever):
         contextualize_q_system_prompt = """Given a chat history and the latest user question \
         which might reference context in the chat history, formulate a standalone question \
@@ -178,7 +702,48 @@ class RagManager:
                                     MessagesPlaceholder("chat_history"),
                                     ("human", "{input}"),
                                 ])
-        return create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
+        rephrase_chain = contextualize_q_prompt | llm | StrOutputParser()
+        rephrase_and_retrieve = rephrase_chain | retriever
+        if self.speculative_retrieval:
+            rephrase_and_retrieve = RunnableLambda(
+                lambda x, config: retriever.invoke(rephrase_chain.invoke(x, config), config),
+                afunc=lambda x, config: self._rephrase_and_retrieve(rephrase_chain, retriever, x, config))
+
+        # Rewriting the question costs a full LLM generation, so it only happens when it can change the result
+        return RunnableBranch(
+            (lambda x: not self._should_rephrase(x["input"], x.get("chat_history", [])), (lambda x: x["input"]) | retriever),
+            rephrase_and_retrieve,
+        ).with_config(run_name="chat_retriever_chain")
+
+    async def _rephrase_and_retrieve(self, rephrase_chain, retriever, inputs: dict, config: RunnableConfig) -> List[Document]:
+        # Searches for the question as asked while the LLM rewrites it. Most rewrites barely change the question,
+        # and then the search for the rewritten one is skipped
+        speculative = asyncio.ensure_future(retriever.ainvoke(inputs["input"], config))
+        try:
+            question = await rephrase_chain.ainvoke(inputs, config)
+        except BaseException:
+            speculative.cancel()
+            raise
+        if query_overlap(inputs["input"], question) >= self.speculative_overlap:
+            self.rephrase_counts["speculative_used"] += 1
+            return await speculative
+        self.rephrase_counts["speculative_discarded"] += 1
+        speculative.cancel()
+        speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await retriever.ainvoke(question, config)
+
+    def _should_rephrase(self, question: str, history: List[BaseMessage]) -> bool:
+        if not history:
+            self.rephrase_counts["skipped_no_history"] += 1
+            return False
+        if self.rephrase_policy == 'never' or (self.rephrase_policy == 'auto' and not needs_rephrase(question, history)):
+            self.rephrase_counts["skipped_by_gate"] += 1
+            return False
+        self.rephrase_counts["performed"] += 1
+        return True
+
+    def rephrase_stats(self) -> dict:
+        return dict(self.rephrase_counts)
 
     async def create_question_answer_chain(self, llm, name=None, expertise=None):
 
@@ -205,41 +770,124 @@ class RagManager:
             output_messages_key="answer",
         )
     
-    def get_session_history(self,store, session_id: str):
-        if session_id not in store:
-            store[session_id] = ChatMessageHistory()
-        return store[session_id]
+    def get_session_history(self, messages: List[BaseMessage]) -> BaseChatMessageHistory:
+        # A copy, so the turns the chain appends after answering don't end up in the cached window;
+        # they are added when the message is saved
+        return ChatMessageHistory(messages=list(messages))
+
+    async def get_chat_history(self, conversation_id: str) -> List[BaseMessage]:
+        window = self._chat_histories.get(conversation_id)
+        if window is None:
+            async with db_session_context() as session:
+                stmt = (select(Message)
+                        .filter(Message.conversation_id == conversation_id)
+                        .order_by(Message.timestamp.desc())
+                        .limit(self.chat_history_window))
+                messages = (await session.execute(stmt)).scalars().all()
+            window = deque(maxlen=2 * self.chat_history_window)
+            for message in reversed(messages):
+                window.extend([HumanMessage(content=message.prompt), AIMessage(content=message.chat_response)])
+            self._chat_histories.put(conversation_id, window)
+        return list(window)
+
+    def append_chat_history(self, conversation_id: str, prompt: str, chat_response: str):
+        # Conversations that aren't cached are loaded from the Message table on their next turn
+        window = self._chat_histories.get(conversation_id)
+        if window is not None:
+            window.extend([HumanMessage(content=prompt), AIMessage(content=chat_response)])
+
+    def invalidate_chat_history(self, conversation_id: str):
+        self._chat_histories.pop(conversation_id)
     
 
     async def retrieve_and_generate_chat_context(self, collection_name, query, llm, session_id =None) -> str:
+        answer, rag_chain, cache_key = await self._prepare_chat_chain(collection_name, query, llm, session_id)
+        if answer is not None:
+            return {"input": query, "answer": answer}
+
+        # ainvoke keeps the event loop free while the LLM generates, so other requests are served meanwhile
+        async with self._using_model(llm):
+            response = await rag_chain.ainvoke({
+                "input": query},
+                config={
+                    "configurable": {
+                        "session_id": session_id},
+                    "callbacks": [self._prompt_stats]},
+                        )
+        print("Response: ", response)
+        self._remember_answer(cache_key, response["answer"])
+        logger.info(f"Query embedding cache: {self.query_embedding_stats()}")
+        logger.info(f"Question rephrasing: {self.rephrase_stats()}")
+        return response    
+
+    async def stream_chat_context(self, collection_name, query, llm, session_id=None) -> AsyncIterator[str]:
+        # Same as retrieve_and_generate_chat_context, but yields the answer piece by piece as the LLM produces it
+        answer, rag_chain, cache_key = await self._prepare_chat_chain(collection_name, query, llm, session_id)
+        if answer is not None:
+            yield answer
+            return
+
+        parts = []
+        async with self._using_model(llm):
+            async for chunk in rag_chain.astream({"input": query}, config={"configurable": {"session_id": session_id},
+                                                                           "callbacks": [self._prompt_stats]}):
+                if chunk.get("answer"):
+                    parts.append(chunk["answer"])
+                    yield chunk["answer"]
+        self._remember_answer(cache_key, "".join(parts))
+        logger.info(f"Query embedding cache: {self.query_embedding_stats()}")
+        logger.info(f"Question rephrasing: {self.rephrase_stats()}")
+
+    async def _prepare_chat_chain(self, collection_name, query, llm, session_id):
+        # Returns (cached answer, None, None) on an answer cache hit, otherwise (None, chain, cache key).
+        # The cache key is None when the answer shouldn't be cached
         resources_m = ResourcesManager()
         personas_m = PersonasManager()
 
         resource = await resources_m.retrieve_resource(collection_name)
         persona_id = resource.persona_id
+
+        # Only questions that open a conversation are answered from the cache; follow-ups depend on the history
+        history = await self.get_chat_history(session_id) if session_id else []
+        cache_key = None
+        if self.answer_cache_enabled and not history:
+            scope = (collection_name, persona_id, getattr(llm, "model", None))
+            question = normalize_query(query)
+            answer = self._answers.get(scope, question)
+            vector = None
+            if answer is None:
+                # Keyword lookups aren't embedded, so they keep skipping the embedder on the lexical fast path
+                if self._answers.similarity is not None and not is_keyword_lookup(query, self.lexical_max_words):
+                    vector = await asyncio.get_running_loop().run_in_executor(None, self._get_answer_embeddings().embed_query, query)
+                answer = self._answers.get_similar(scope, vector)
+            if answer is not None:
+                logger.info(f"Answer cache: {self.answer_cache_stats()}")
+                return answer, None, None
+            cache_key = (scope, question, vector)
+
         persona = await personas_m.retrieve_persona(persona_id)        
         expertise = persona.description
         name= persona.name
         
         vectorstore = await self.initialize_chroma(collection_name)
-        retriever = vectorstore.as_retriever()
+        retriever = await self.create_retriever(collection_name, vectorstore)
 
         history_aware_retriever = self.create_history_aware_retriever(llm, retriever)
         question_answer_chain = await self.create_question_answer_chain(llm, name, expertise)
 
         rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
         
-        store = {}
-        conversational_rag_chain = self.create_conversational_chain(rag_chain, lambda session_id: self.get_session_history(store, session_id))
-
-        response = conversational_rag_chain.invoke({
-            "input": query},
-            config={
-                "configurable": {
-                    "session_id": session_id}},
-                    )
-        print("Response: ", response)
-        return response    
+        conversational_rag_chain = self.create_conversational_chain(rag_chain, lambda session_id: self.get_session_history(history))
+        return None, conversational_rag_chain, cache_key
+
+    def _using_model(self, llm):
+        # Has the model loaded, and keeps it from being evicted, while the chain runs; other LLMs are left alone
+        model = getattr(llm, "model", None)
+        return ModelResidencyManager().use(model) if model else contextlib.nullcontext()
+
+    def _remember_answer(self, cache_key, answer: str):
+        if cache_key is not None and answer:
+            self._answers.put(*cache_key, answer)
     
     async def retrieve_and_generate(self, collection_name, query, llm) -> str:
         resources_m = ResourcesManager()
@@ -265,33 +913,42 @@ class RagManager:
         print(f"\n\nPrompt: {prompt}\n")
 
         vectorstore = await self.initialize_chroma(collection_name)
-        retriever = vectorstore.as_retriever()
+        retriever = await self.create_retriever(collection_name, vectorstore)
 
         question_answer_chain = create_stuff_documents_chain(llm, prompt)
         
         rag_chain = create_retrieval_chain(retriever, question_answer_chain)
         
-        async for chunk in rag_chain.astream({"input": query}):
-            print("chunk:", chunk)
         print("Query: ", query)
 
-        response = rag_chain.invoke({"input": query})
+        response = await rag_chain.ainvoke({"input": query}, config={"callbacks": [self._prompt_stats]})
         return response
     
-    async def save_file(self, file: UploadFile, directory: Path):
+    async def save_file(self, file: UploadFile, directory: Path) -> Tuple[str, str]:
+        # Copy the upload's spooled temp file into the data directory off the event loop, hashing it
+        # on the way so duplicates can be detected without a second read
         file_path = directory / file.filename
-        async with aiofiles.open(file_path, 'wb') as out_file:
-            while content := await file.read(1024):  # Read in chunks
-                await out_file.write(content)
-        return str(file_path.absolute())
+        loop = asyncio.get_running_loop()
+        content_hash = await loop.run_in_executor(None, _write_upload, file.file, file_path, self.upload_read_size)
+        return str(file_path.absolute()), content_hash
 
     
     async def upload_file(self, resource_id: str, files: List[UploadFile]) -> Union[List[dict], str]:
-        all_files_paths = []
+        try:
+            files_to_index, duplicate_file_ids = await self.save_uploads(resource_id, files)
+            result = await self.index_uploads(resource_id, files_to_index) if files_to_index else []
+            return result + await self.duplicate_file_info(duplicate_file_ids)
+        except Exception as e:
+            print(f"An error occurred while uploading files: {e}")
+            return "File upload failed"
+
+    async def save_uploads(self, resource_id: str, files: List[UploadFile]) -> Tuple[List[dict], List[str]]:
+        # Saves the uploads and returns the files that still need indexing ({"file_id", "file_name", "path"})
+        # along with the ids of already indexed (or already uploaded in this batch) files that other uploads duplicate
         all_files_ids = []
         for file in files:
             file_id = str(uuid4())
-            # Create a File entry in the database with status 'splitting'
+            # Create a File entry in the database with status 'waiting'
             await self.create_file(
                 file_id=file_id,
                 assistant_id=resource_id,
@@ -299,34 +956,238 @@ class RagManager:
                 indexing_status=FileStatus.WAITING.value
             )
             all_files_ids.append(file_id)
+
+        async def save_and_mark(file: UploadFile, file_id: str) -> Tuple[str, str]:
+            # Each upload gets its own directory so files with the same name and concurrent jobs don't collide
+            directory = uploads_dir / resource_id / file_id
+            directory.mkdir(parents=True, exist_ok=True)
+            path, content_hash = await self.save_file(file, directory)
+            await self.update_file(file_id, indexing_status=FileStatus.UPLOADED.value, content_hash=content_hash)
+            return path, content_hash
+
+        saved_files = await asyncio.gather(*[save_and_mark(file, file_id) for file, file_id in zip(files, all_files_ids)])
+
+        # Uploads whose bytes are already indexed for this assistant reuse the existing pages and chunks
+        files_to_index, duplicates = [], []
+        indexed_hashes = {}
+        for (path, content_hash), file, file_id in zip(saved_files, files, all_files_ids):
+            existing_file_id = indexed_hashes.get(content_hash) or await self.find_indexed_file(resource_id, content_hash)
+            if existing_file_id:
+                duplicates.append((file_id, existing_file_id))
+            else:
+                indexed_hashes[content_hash] = file_id
+                files_to_index.append({"file_id": file_id, "file_name": file.filename, "path": path})
+
+        for file_id, existing_file_id in duplicates:
+            await self.delete_file_from_db([file_id])
+            await self.delete_tmp_files(resource_id, [file_id])
+        return files_to_index, [existing_file_id for _, existing_file_id in duplicates]
+
+    async def index_uploads(self, resource_id: str, files_to_index: List[dict]) -> List[dict]:
+        # The uploads are only removed once indexing has succeeded or failed. A cancelled run (the server
+        # shutting down) leaves them in place for the job to resume from on the next start
+        file_ids = [file["file_id"] for file in files_to_index]
         try:
-            
-            for file, file_id in zip(files, all_files_ids):
-                
-                directory = Path(f"./uploads/{resource_id}")
-                directory.mkdir(parents=True, exist_ok=True)
-                
-                path = await self.save_file(file, directory)
-                await self.update_file_status(file_id, FileStatus.UPLOADED.value)
-                all_files_paths.append(path)
-
-            result = await self.create_index(resource_id, all_files_paths, all_files_ids)   
-            await self.delete_tmp_files(resource_id)
-            return result
+            result = await self.create_index(resource_id, [file["path"] for file in files_to_index], file_ids)
+        except Exception:
+            await self.delete_tmp_files(resource_id, file_ids)
+            raise
+        await self.delete_tmp_files(resource_id, file_ids)
+        return result
+
+    async def save_revision(self, resource_id: str, file_id: str, file: UploadFile) -> Optional[dict]:
+        # Saves a revised version of an indexed file and returns it as the entry of the job that re-indexes it
+        # ({"file_id", "file_name", "path", "content_hash", "reindex"}); None if the assistant has no such file
+        files = await self.retrieve_file(file_id)
+        if not files or files[0].assistant_id != resource_id:
+            return None
+
+        directory = uploads_dir / resource_id / file_id
+        directory.mkdir(parents=True, exist_ok=True)
+        try:
+            path, content_hash = await self.save_file(file, directory)
+        except Exception:
+            await self.delete_tmp_files(resource_id, [file_id])
+            raise
+        return {"file_id": file_id, "file_name": file.filename, "path": path, "content_hash": content_hash, "reindex": True}
+
+    async def reindex_file(self, resource_id: str, revision: dict) -> dict:
+        # Re-indexes a revised version of an indexed file. Pages are matched to the stored ones by the hash of
+        # their text: only new or changed pages are split and embedded, and pages that are gone are removed
+        file_id = revision["file_id"]
+        files = await self.retrieve_file(file_id)
+        try:
+            if revision["content_hash"] == files[0].content_hash and files[0].indexing_status == FileStatus.DONE.value:
+                pages = await self.retrieve_pages(file_id)
+                result = {"file_id": file_id, "pages_unchanged": len(pages), "pages_added": 0, "pages_removed": 0}
+            else:
+                result = await self._reindex_saved_file(resource_id, revision["path"], file_id, revision["file_name"],
+                                                        revision["content_hash"])
+        except Exception:
+            # As in index_uploads, a cancelled re-index keeps the upload; the next re-index of the file replaces it
+            await self.delete_tmp_files(resource_id, [file_id])
+            raise
+        await self.delete_tmp_files(resource_id, [file_id])
+        return result
+
+    async def _reindex_saved_file(self, resource_id: str, path: str, file_id: str, file_name: str, content_hash: str) -> dict:
+        progress = self._start_progress(file_id)
+        try:
+            result = await self._reindex_file(resource_id, path, file_id, progress)
         except Exception as e:
-            print(f"An error occurred while uploading files: {e}")
-            return "File upload failed"
+            await progress.set_stage(FileStatus.FAILED.value)
+            raise e
+        finally:
+            await progress.close()
+            self.progress.pop(file_id, None)
+        await self.update_file(file_id, name=file_name, content_hash=content_hash)
+        await self._refresh_footprint(resource_id)
+        self.invalidate_answers(resource_id)
+        return result
+
+    async def _reindex_file(self, resource_id: str, path: str, file_id: str, progress: FileProgress) -> dict:
+        loop = asyncio.get_running_loop()
+        vectorstore = await self.initialize_chroma(resource_id)
+
+        async with self._parse_semaphore:
+            docs = await loop.run_in_executor(self._get_parse_executor(), load_pdf, path)
+        progress.pages_total = len(docs)
+        await progress.set_stage(FileStatus.SPLITTING.value)
+
+        # Pages keep their rows and vectors as long as the same text is still somewhere in the document
+        stored_pages = {}
+        for page in await self.retrieve_pages(file_id):
+            stored_pages.setdefault(page.content_hash, []).append(page)
+        changed_docs, moved_pages = [], {}
+        for doc in docs:
+            matches = stored_pages.get(text_hash(doc.page_content))
+            if not matches:
+                changed_docs.append(doc)
+                continue
+            page = matches.pop()
+            if page.page_number != doc.metadata.get("page"):
+                moved_pages[page.id] = doc
+        removed_pages = [page.id for pages in stored_pages.values() for page in pages]
+        await progress.advance(pages=len(docs) - len(changed_docs))
+
+        # Add the new pages before removing the old ones so the file stays searchable throughout
+        await self._run_pipeline(resource_id, file_id, self._doc_batches(changed_docs), vectorstore, progress)
+
+        await self.delete_pages(vectorstore, removed_pages)
+        await self._move_pages(vectorstore, moved_pages)
+        async with db_session_context() as session:
+            chunks = (await session.execute(select(func.count()).select_from(Chunk).filter(Chunk.file_id == file_id))).scalar()
+        progress.chunks_total = progress.chunks_embedded = chunks
+        if docs:
+            progress.checkpoint(docs[-1].metadata.get("page", len(docs) - 1))
+        await progress.set_stage(FileStatus.DONE.value)
+
+        logger.info(f"Re-indexed file {file_id}: {len(docs) - len(changed_docs)} pages unchanged, "
+                    f"{len(changed_docs)} added or changed, {len(removed_pages)} removed")
+        return {"file_id": file_id,
+                "pages_unchanged": len(docs) - len(changed_docs),
+                "pages_added": len(changed_docs),
+                "pages_removed": len(removed_pages)}
+
+    async def _move_pages(self, vectorstore, moved_pages: Dict[str, Document]):
+        # Pages that kept their text but not their position keep their chunks. Their page number is updated
+        # wherever it is stored: the Page row, the chunks' full-text rows and the chunks' vector metadata
+        if not moved_pages:
+            return
+        async with db_session_context() as session:
+            for page_id, doc in moved_pages.items():
+                await session.execute(update(Page).where(Page.id == page_id).values(page_number=doc.metadata.get("page")))
+                await set_chunk_texts_page(session, page_id, doc.metadata.get("page"))
+            chunks = (await session.execute(select(Chunk.id, Chunk.page_id).filter(Chunk.page_id.in_(list(moved_pages))))).all()
+        if not chunks:
+            return
+
+        def update_metadata():
+            page_ids = {chunk.id: chunk.page_id for chunk in chunks}
+            stored = vectorstore._collection.get(ids=list(page_ids), include=["metadatas"])
+            # The chunk keeps its own fields (original_id, start_index); the page-level ones come from the new page
+            metadatas = [{**(metadata or {}), **moved_pages[page_ids[chunk_id]].metadata}
+                         for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])]
+            vectorstore._collection.update(ids=stored["ids"], metadatas=metadatas)
+        await asyncio.get_running_loop().run_in_executor(None, update_metadata)
+
+    async def _doc_batches(self, docs: List[Document]) -> AsyncIterator[List[Document]]:
+        for i in range(0, len(docs), self.index_batch_pages):
+            yield docs[i:i + self.index_batch_pages]
+
+    async def delete_pages(self, vectorstore, page_ids: List[str]):
+        # Removes pages along with their chunks from SQLite and their vectors from Chroma
+        if not page_ids:
+            return
+        async with db_session_context() as session:
+            chunk_ids = (await session.execute(select(Chunk.id).filter(Chunk.page_id.in_(page_ids)))).scalars().all()
+            if chunk_ids:
+                await asyncio.get_running_loop().run_in_executor(None, lambda: vectorstore.delete(ids=list(chunk_ids)))
+            await session.execute(delete(Chunk).where(Chunk.page_id.in_(page_ids)))
+            await delete_chunk_texts(session, "page_id", page_ids)
+            await session.execute(delete(Page).where(Page.id.in_(page_ids)))
+
+    async def rollback_files(self, resource_id: str, file_ids: List[str]):
+        # Drops whatever interrupted runs wrote after each file's checkpoint (pages may be in SQLite without
+        # their vectors), so indexing can resume from the checkpoint. Files without one start over
+        vectorstore = await self.initialize_chroma(resource_id)
+        for file_id in file_ids:
+            files = await self.retrieve_file(file_id)
+            if not files:
+                continue
+            checkpoint = files[0].checkpoint_page
+            pages = await self.retrieve_pages(file_id)
+            kept = {page.id for page in pages
+                    if checkpoint is not None and page.page_number is not None and page.page_number <= checkpoint}
+            await self.delete_pages(vectorstore, [page.id for page in pages if page.id not in kept])
+            async with db_session_context() as session:
+                chunks = (await session.execute(select(func.count()).select_from(Chunk).filter(Chunk.page_id.in_(kept)))).scalar()
+            await self.update_file(file_id, indexing_status=FileStatus.UPLOADED.value,
+                                   checkpoint_page=checkpoint if kept else None,
+                                   pages_processed=len(kept), chunks_total=chunks, chunks_embedded=chunks)
 
+    async def rollback_reindex(self, resource_id: str, file_ids: List[str]):
+        # An interrupted re-index leaves old, moved and new pages mixed in a way no checkpoint describes,
+        # so the files start over and their revision is indexed from scratch
+        for file_id in file_ids:
+            await self.update_file(file_id, checkpoint_page=None)
+        await self.rollback_files(resource_id, file_ids)
+
+    async def find_indexed_file(self, resource_id: str, content_hash: str) -> Optional[str]:
+        async with db_session_context() as session:
+            stmt = select(File.id).filter(
+                File.assistant_id == resource_id,
+                File.content_hash == content_hash,
+                File.indexing_status == FileStatus.DONE.value
+            ).limit(1)
+            return (await session.execute(stmt)).scalar_one_or_none()
 
-    async def delete_tmp_files(self, assistant_id: str):
+    async def duplicate_file_info(self, file_ids: List[str]) -> List[dict]:
+        file_info_list = []
+        for file_id in file_ids:
+            files = await self.retrieve_file(file_id)
+            if not files:
+                continue
+            pages = await self.retrieve_pages(file_id)
+            file_info_list.extend({"file_id": file_id, "file_name": files[0].name, "page_id": page.id, "duplicate": True} for page in pages)
+        return file_info_list
+
+
+    async def delete_tmp_files(self, assistant_id: str, file_ids: Optional[List[str]] = None):
         try:
             # Define the directory path using the assistant_id
-            directory = Path(f"./uploads/{assistant_id}")
+            directory = uploads_dir / assistant_id
             
             # Check if the directory exists
             if directory.exists() and directory.is_dir():
-                # Remove the directory and all its contents
-                shutil.rmtree(directory)
+                if file_ids is None:
+                    # Remove the directory and all its contents
+                    shutil.rmtree(directory)
+                    return
+                for file_id in file_ids:
+                    shutil.rmtree(directory / file_id, ignore_errors=True)
+                if not any(directory.iterdir()):
+                    directory.rmdir()
             else:
                 logger.error(f"Directory for assistant {assistant_id} does not exist.", exc_info=True)
         except Exception as e:
@@ -335,10 +1196,19 @@ class RagManager:
     async def retrieve_file(self, file_id:str) -> Optional[List[FileSchema]]:
         async with db_session_context() as session:            
             result = await session.execute(select(File).filter(File.id == file_id))
-            files = [FileSchema.from_orm(file) for file in result.scalars().all()]
+            files = [self._apply_live_progress(FileSchema.from_orm(file)) for file in result.scalars().all()]
             if files:
                 return files
             return None
+
+    def _apply_live_progress(self, file: FileSchema) -> FileSchema:
+        # Files being indexed report their in-memory progress, which can be ahead of the last flush to the db
+        progress = self.progress.get(file.id)
+        if progress:
+            for key, value in progress.as_dict().items():
+                if value is not None:
+                    setattr(file, key, value)
+        return file
         
     # Method to retrieve pages for a given file_id
     async def retrieve_pages(self, file_id: str) -> List[Page]:
@@ -366,6 +1236,7 @@ class RagManager:
             
             # Collect and delete chunks for the files
             await self._process_files_for_deletion(files, vectorstore)
+            self.invalidate_answers(resource_id)
 
         return "Documents deleted"
 
@@ -428,6 +1299,8 @@ class RagManager:
             # Retrieve and delete chunks
             await self._delete_chunks(page.id, session)
 
+        await delete_chunk_texts(session, "file_id", [file_id])
+
         # Delete all pages for the file
         stmt_delete_pages = delete(Page).where(Page.id.in_([page.id for page in pages]))
         await session.execute(stmt_delete_pages)
@@ -447,7 +1320,7 @@ class RagManager:
             query = query.offset(offset).limit(limit)
 
             result = await session.execute(query)
-            files = [FileSchema.from_orm(file) for file in result.scalars().all()]
+            files = [self._apply_live_progress(FileSchema.from_orm(file)) for file in result.scalars().all()]
             total_count = await self._get_total_count(filters)
 
             return files, total_count
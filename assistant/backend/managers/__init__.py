@@ -7,6 +7,8 @@ from .UsersManager import UsersManager
 from .PersonasManager import PersonasManager
 from .AuthManager import AuthManager
 from .RagManager import RagManager
+from .IndexingJobsManager import IndexingJobsManager
+from .ModelResidencyManager import ModelResidencyManager
 from .MessagesManager import MessagesManager
 from .ConversationsManager import ConversationsManager
 from .VoicesFacesManager import VoicesFacesManager
@@ -22,6 +24,8 @@ manager_classes = [
     AuthManager,
     PersonasManager,
     RagManager,
+    IndexingJobsManager,
+    ModelResidencyManager,
     MessagesManager,
     ConversationsManager,
     VoicesFacesManager
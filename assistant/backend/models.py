@@ -1,5 +1,6 @@
 from uuid import uuid4
 from datetime import datetime
+from sqlalchemy import Index
 from sqlmodel import Field, Relationship
 from backend.db import SQLModelBase
 from typing import List, Optional, ForwardRef
@@ -75,15 +76,35 @@ class Share(SQLModelBase, table=True):
     is_revoked: bool = Field()
 
 class File(SQLModelBase, table=True):
+    __table_args__ = (Index('ix_file_assistant_id_content_hash', 'assistant_id', 'content_hash'),)
     id: str = Field(primary_key=True, default_factory=lambda: str(uuid4()))
     name: str = Field()
     assistant_id: str = Field(foreign_key="resource.id")
     indexing_status: str = Field()
+    content_hash: str | None = Field(default=None)  # sha256 of the uploaded bytes, used to skip re-indexing duplicates
+    checkpoint_page: int | None = Field(default=None)  # last page whose chunks are in both SQLite and Chroma
+    pages_total: int | None = Field(default=None)
+    pages_processed: int = Field(default=0)
+    chunks_total: int = Field(default=0)
+    chunks_embedded: int = Field(default=0)
+
+class IndexingJob(SQLModelBase, table=True):
+    __tablename__ = "indexing_job"
+    id: str = Field(primary_key=True, default_factory=lambda: str(uuid4()))
+    assistant_id: str = Field(foreign_key="resource.id")
+    status: str = Field(index=True)
+    files: str = Field()  # JSON list of {"file_id", "file_name", "path"} to index
+    attempts: int = Field(default=0)
+    error: str | None = Field(default=None)
+    created_timestamp: str = Field()
+    updated_timestamp: str = Field()
 
 class Page(SQLModelBase, table=True):
     id: str = Field(primary_key=True, default_factory=lambda: str(uuid4()))
     file_id: str= Field(foreign_key="file.id")
     assistant_id: str= Field(foreign_key="resource.id")
+    page_number: int | None = Field(default=None)
+    content_hash: str | None = Field(default=None)  # sha256 of the page's extracted text, used for incremental re-indexing
 
 class Chunk(SQLModelBase, table=True):
     id: str = Field(primary_key=True, default_factory=lambda: str(uuid4()))
@@ -100,6 +121,8 @@ class Message(SQLModelBase, table=True):
     chat_response: str = Field()
     voice_active: str = Field()
 
+    __table_args__ = (Index('ix_message_conversation_id_timestamp', 'conversation_id', 'timestamp'),)
+
 class Conversation(SQLModelBase, table=True):
     id: str = Field(primary_key=True, default_factory=lambda: str(uuid4()))
     name: str = Field()
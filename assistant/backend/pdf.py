@@ -0,0 +1,13 @@
+from typing import List
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+# Run in the parse process pool. Spawned workers import this module to unpickle the functions,
+# so it stays free of the managers and their dependencies
+
+def load_pdf(path: str) -> List[Document]:
+    return PyPDFLoader(path).load()
+
+def count_pdf_pages(path: str) -> int:
+    return len(PdfReader(path).pages)
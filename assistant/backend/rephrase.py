@@ -0,0 +1,34 @@
+import re
+from typing import Sequence
+
+# Words that usually point back at something said earlier in the conversation
+FOLLOW_UP_WORDS = {
+    "it", "its", "it's", "itself", "they", "them", "their", "theirs", "this", "that", "these", "those",
+    "he", "him", "his", "she", "her", "hers", "there", "former", "latter", "above", "previous", "same",
+    "other", "another", "one", "ones", "else", "more", "again", "also"
+}
+# Openings that continue the previous turn rather than start a new topic
+FOLLOW_UP_OPENERS = ("and", "but", "so", "then", "also", "what about", "how about", "what else")
+
+def needs_rephrase(question: str, history: Sequence = (), max_short_words: int = 4) -> bool:
+    # Cheap stand-in for asking the LLM to rewrite the question: only questions that may depend on the chat
+    # history are rewritten. Very short questions ("why?", "tell me more"), follow-up openings and pronouns or
+    # back references count as dependent; anything else is taken to be self-contained already
+    if not history:
+        return False
+    words = re.findall(r"[\w']+", question.casefold())
+    if not words:
+        return False
+    if len(words) <= max_short_words:
+        return True
+    text = " ".join(words)
+    if any(text == opener or text.startswith(opener + " ") for opener in FOLLOW_UP_OPENERS):
+        return True
+    return any(word in FOLLOW_UP_WORDS for word in words)
+
+def query_overlap(question: str, rephrased: str) -> float:
+    # Jaccard similarity of the two questions' words; 1.0 when the LLM returned the question as it was
+    words, rephrased_words = set(re.findall(r"[\w']+", question.casefold())), set(re.findall(r"[\w']+", rephrased.casefold()))
+    if not words and not rephrased_words:
+        return 1.0
+    return len(words & rephrased_words) / len(words | rephrased_words)
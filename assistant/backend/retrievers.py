@@ -0,0 +1,125 @@
+import re
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text, bindparam
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from backend.db import db_session_context
+
+logger = logging.getLogger(__name__)
+
+FTS_COLUMNS = ["text", "chunk_id", "assistant_id", "file_id", "page_id", "page_number", "start_index"]
+
+def fts_query(query: str) -> Optional[str]:
+    # Each word as a quoted FTS5 string, OR-ed together, so user input can't be read as query syntax
+    words = re.findall(r"\w+", query.casefold())
+    if not words:
+        return None
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
+
+async def add_chunk_texts(session, rows: List[dict]):
+    if rows:
+        await session.execute(text(f"INSERT INTO chunk_fts ({', '.join(FTS_COLUMNS)}) "
+                                   f"VALUES ({', '.join(':' + column for column in FTS_COLUMNS)})"), rows)
+
+async def delete_chunk_texts(session, column: str, values: List[str]):
+    # column is one of the id columns of chunk_fts
+    if values:
+        stmt = text(f"DELETE FROM chunk_fts WHERE {column} IN :values").bindparams(bindparam("values", expanding=True))
+        await session.execute(stmt, {"values": list(values)})
+
+async def set_chunk_texts_page(session, page_id: str, page_number: Optional[int]):
+    await session.execute(text("UPDATE chunk_fts SET page_number = :page_number WHERE page_id = :page_id"),
+                          {"page_number": page_number, "page_id": page_id})
+
+async def search_chunk_texts(assistant_id: str, query: str, k: int) -> List[Tuple[Document, float]]:
+    # BM25 search over an assistant's chunks, best first; the score is FTS5's bm25(), lower is better
+    match = fts_query(query)
+    if match is None:
+        return []
+    stmt = text("SELECT chunk_id, text, file_id, page_id, page_number, start_index, bm25(chunk_fts) AS score "
+                "FROM chunk_fts WHERE chunk_fts MATCH :match AND assistant_id = :assistant_id "
+                "ORDER BY score LIMIT :k")
+    async with db_session_context() as session:
+        rows = (await session.execute(stmt, {"match": match, "assistant_id": assistant_id, "k": k})).all()
+    return [(Document(id=row.chunk_id, page_content=row.text,
+                      metadata={"file_id": row.file_id, "original_id": row.page_id, "page": row.page_number,
+                                "start_index": row.start_index}), row.score)
+            for row in rows]
+
+def term_coverage(query: str, text: str) -> float:
+    # Share of the query's distinct words found in the text, from 0 to 1. BM25 scores have no fixed scale,
+    # so this is what relevance thresholds are compared with for lexical matches
+    words = set(re.findall(r"\w+", query.casefold()))
+    if not words:
+        return 0.0
+    return len(words & set(re.findall(r"\w+", text.casefold()))) / len(words)
+
+def is_identifier(token: str) -> bool:
+    # Course codes (CS101), names from code (max_tokens, numpy.dot, camelCase) and acronyms (BM25, RRF)
+    token = token.strip(".,;:!()[]{}")
+    return bool(re.search(r"\d|_|\w[.:/]\w|[a-z][A-Z]", token) or (len(token) > 1 and token.isupper()))
+
+def is_keyword_lookup(query: str, max_words: int) -> bool:
+    # A few words without a question mark that name something exactly: a quoted phrase, or one with an
+    # identifier in it. Short questions in plain words ("explain photosynthesis") still need the embedder
+    words = re.findall(r"\w+", query)
+    if not 0 < len(words) <= max_words or "?" in query:
+        return False
+    query = query.strip()
+    return (len(query) > 1 and query[0] in "\"'“" and query[-1] in "\"'”") or any(map(is_identifier, query.split()))
+
+class HybridRetriever(BaseRetriever):
+    # Fuses the BM25 ranking of the assistant's chunks with the vector store's ranking by reciprocal rank
+    # fusion. Keyword lookups with at least k lexical matches are answered from the BM25 ranking alone, without
+    # embedding the query. With a score_threshold, vector results with a lower relevance score and lexical
+    # results containing a smaller share of the query's words are left out.
+    vectorstore: Any
+    assistant_id: str
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    keyword_max_words: int = 3
+    score_threshold: Optional[float] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # The chunk text index is only reachable through the async engine; synchronous callers get vector results
+        return self.vectorstore.similarity_search(query, k=self.k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        if is_keyword_lookup(query, self.keyword_max_words):
+            lexical = await self._lexical_search(query, self.k)
+            if len(lexical) >= self.k:
+                logger.debug(f"Lexical fast path for {query!r}: {len(lexical)} chunks")
+                return lexical
+
+        lexical, vector = await asyncio.gather(
+            self._lexical_search(query, self.fetch_k),
+            self._vector_search(query)
+        )
+        return self.fuse(lexical, vector)
+
+    async def _lexical_search(self, query: str, k: int) -> List[Document]:
+        results = await search_chunk_texts(self.assistant_id, query, k)
+        if self.score_threshold is None:
+            return [doc for doc, _ in results]
+        return [doc for doc, _ in results if term_coverage(query, doc.page_content) >= self.score_threshold]
+
+    async def _vector_search(self, query: str) -> List[Document]:
+        if self.score_threshold is None:
+            return await self.vectorstore.asimilarity_search(query, k=self.fetch_k)
+        results = await self.vectorstore.asimilarity_search_with_relevance_scores(query, k=self.fetch_k)
+        return [doc for doc, score in results if score >= self.score_threshold]
+
+    def fuse(self, *rankings: List[Document]) -> List[Document]:
+        # Reciprocal rank fusion: each ranking adds 1 / (rrf_k + rank) to a chunk's score
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Document] = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking, start=1):
+                scores[doc.id] = scores.get(doc.id, 0.0) + 1.0 / (self.rrf_k + rank)
+                docs.setdefault(doc.id, doc)
+        best = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [docs[doc_id] for doc_id in best]
@@ -201,6 +201,12 @@ class FileBaseSchema(BaseModel):
     name: str
     assistant_id: str
     indexing_status: str
+    content_hash: Optional[str] = None
+    pages_total: Optional[int] = None
+    pages_processed: Optional[int] = 0
+    chunks_total: Optional[int] = 0
+    chunks_embedded: Optional[int] = 0
+    checkpoint_page: Optional[int] = None
     class Config:
         orm_mode = True
         from_attributes = True
@@ -209,4 +215,15 @@ class FileCreateSchema(FileBaseSchema):
     pass
 
 class FileSchema(FileBaseSchema):
-    id: str
\ No newline at end of file
+    id: str
+
+# Indexing job schemas
+class IndexingJobSchema(BaseModel):
+    id: str
+    assistant_id: str
+    status: str
+    file_ids: List[str]
+    attempts: int
+    error: Optional[str] = None
+    created_timestamp: str
+    updated_timestamp: str
@@ -0,0 +1,172 @@
+# End-to-end ingestion benchmark: generates synthetic PDFs and runs them through RagManager.upload_file
+# against a deterministic in-process embedder with configurable latency, so ingestion throughput can be
+# measured without Ollama. Vectors go to a temporary Chroma store; page, chunk and file rows go to the
+# real database under a throwaway assistant id and are removed afterwards.
+#   python -m backend.tests.bench_ingestion --files 4 --pages 200 --embed-latency 0.05
+#   python -m backend.tests.bench_ingestion --output bench_ingestion.jsonl   # append a result line tagged with the commit
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List
+from uuid import uuid4
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from sqlalchemy import delete, text
+from starlette.datastructures import UploadFile
+from backend.db import db_session_context, init_db
+from backend.embeddings import EmbeddingCache
+from backend.managers.RagManager import RagManager
+from backend.models import File, Page, Chunk
+from backend.utils import get_current_rss
+
+WORDS = ["alpha", "beta", "gamma", "delta", "matrix", "vector", "theorem", "proof", "lemma", "course",
+         "student", "energy", "photosynthesis", "derivative", "integral", "equilibrium"]
+
+class SlowFakeEmbeddings(DeterministicFakeEmbedding):
+    # Deterministic vectors with a fixed cost per request plus a cost per text, like a local embedding server
+    request_latency: float = 0.0
+    text_latency: float = 0.0
+    busy_time: float = 0.0
+    texts: int = 0
+
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        time.sleep(self.request_latency + self.text_latency * len(texts))
+        vectors = super().embed_documents(texts)
+        with _stats_lock:
+            self.busy_time += time.perf_counter() - start
+            self.texts += len(texts)
+        return vectors
+
+_stats_lock = threading.Lock()
+
+def make_pdf(path: Path, pages: int, lines: int = 45, words: int = 14, seed: int = 0):
+    # A PDF of random text, lines*words words from WORDS per page
+    rnd = random.Random(seed)
+    write_pdf(path, [[' '.join(rnd.choice(WORDS) for _ in range(words)) for _ in range(lines)] for _ in range(pages)])
+
+def write_pdf(path: Path, page_lines: List[List[str]]):
+    # Minimal PDF writer: one Helvetica text stream per page, with the given lines of plain ASCII text
+    pages = len(page_lines)
+    streams = []
+    for lines in page_lines:
+        ops = ["BT /F1 10 Tf 40 800 Td 12 TL"]
+        ops += [f"({line}) '" for line in lines]
+        ops.append("ET")
+        streams.append("\n".join(ops).encode())
+
+    out, offsets = [b"%PDF-1.4\n"], {}
+    def add(number: int, body: bytes):
+        offsets[number] = sum(len(part) for part in out)
+        out.append(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    page_numbers = [4 + 2 * i for i in range(pages)]
+    add(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    add(2, f"<< /Type /Pages /Kids [{' '.join(f'{n} 0 R' for n in page_numbers)}] /Count {pages} >>".encode())
+    add(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for number, stream in zip(page_numbers, streams):
+        add(number, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {number + 1} 0 R >>".encode())
+        add(number + 1, f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+
+    xref_position = sum(len(part) for part in out)
+    total = 4 + 2 * pages
+    out.append(f"xref\n0 {total}\n0000000000 65535 f \n".encode())
+    out.append("".join(f"{offsets[i]:010d} 00000 n \n" for i in range(1, total)).encode())
+    out.append(f"trailer << /Size {total} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n".encode())
+    path.write_bytes(b"".join(out))
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+async def run_benchmark(args) -> dict:
+    rm = RagManager()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        embedder = SlowFakeEmbeddings(size=args.embed_size, request_latency=args.embed_latency, text_latency=args.embed_text_latency)
+        rm.chroma_db_path = tmp_dir / 'chroma_db'
+        # A fresh cache so every chunk goes through the embedder
+        rm.configure_embeddings(embedder, EmbeddingCache(tmp_dir / 'embedding_cache.db'))
+
+        paths = []
+        for i in range(args.files):
+            path = tmp_dir / f"synthetic-{i}.pdf"
+            make_pdf(path, args.pages, args.lines, args.words, seed=args.seed + i)
+            paths.append(path)
+        uploads = [UploadFile(open(path, 'rb'), filename=path.name) for path in paths]
+
+        resource_id = f"bench-{uuid4()}"
+        peak_rss = start_rss = get_current_rss()
+        start = time.perf_counter()
+        try:
+            task = asyncio.create_task(rm.upload_file(resource_id, uploads))
+            while not task.done():
+                peak_rss = max(peak_rss, get_current_rss())
+                await asyncio.sleep(0.05)
+            result = task.result()
+            elapsed = time.perf_counter() - start
+            if isinstance(result, str):
+                raise RuntimeError(result)
+            file_ids = list(dict.fromkeys(page["file_id"] for page in result))
+            metrics = [rm.ingestion_metrics.get(file_id) for file_id in file_ids]
+        finally:
+            rm.shutdown()
+            for upload in uploads:
+                upload.file.close()
+            async with db_session_context() as session:
+                for model in (Chunk, Page, File):
+                    await session.execute(delete(model).where(model.assistant_id == resource_id))
+                await session.execute(text("DELETE FROM chunk_fts WHERE assistant_id = :assistant_id"), {"assistant_id": resource_id})
+
+    pages = args.files * args.pages
+    rows = sum(m["rows"] for m in metrics)
+    db_time = sum(m["db_time"] for m in metrics)
+    vector_time = sum(m["vector_time"] for m in metrics)
+    return {
+        "commit": current_commit(),
+        "files": args.files,
+        "pages": pages,
+        "chunks": embedder.texts,
+        "seconds": elapsed,
+        "pages_per_sec": pages / elapsed,
+        "chunks_per_sec": embedder.texts / elapsed,
+        "db_rows_per_sec": rows / db_time if db_time else 0.0,
+        "embed_seconds": embedder.busy_time,
+        "chroma_write_seconds": max(0.0, vector_time - embedder.busy_time),
+        "peak_rss_mib": peak_rss / 2**20,
+        "peak_rss_delta_mib": (peak_rss - start_rss) / 2**20,
+        "settings": {key: value for key, value in vars(args).items() if key != "output"}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF ingestion with a fake embedder")
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=100, help='pages per file')
+    parser.add_argument('--lines', type=int, default=45, help='lines of text per page')
+    parser.add_argument('--words', type=int, default=14, help='words per line')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--embed-size', type=int, default=384)
+    parser.add_argument('--embed-latency', type=float, default=0.02, help='seconds per embedding request')
+    parser.add_argument('--embed-text-latency', type=float, default=0.0005, help='seconds per embedded text')
+    parser.add_argument('--output', type=Path, help='append the result as a JSON line to this file')
+    args = parser.parse_args()
+
+    init_db()
+    result = asyncio.run(run_benchmark(args))
+    print(f"commit {result['commit']}: {result['files']} files, {result['pages']} pages, {result['chunks']} chunks in {result['seconds']:.2f}s")
+    print(f"  {result['pages_per_sec']:.1f} pages/s, {result['chunks_per_sec']:.1f} chunks/s, {result['db_rows_per_sec']:.0f} DB rows/s")
+    print(f"  embedding {result['embed_seconds']:.2f}s, Chroma writes {result['chroma_write_seconds']:.2f}s (summed over files)")
+    print(f"  peak RSS {result['peak_rss_mib']:.1f} MiB ({result['peak_rss_delta_mib']:+.1f} MiB)")
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Compares OffsetTextSplitter with LangChain's RecursiveCharacterTextSplitter on a synthetic corpus.
+# Checks that both produce the same chunks and reports pages/sec and chunks/sec for each.
+#   python -m backend.tests.bench_text_splitter --pages 2000 --chunk-size 2000 --chunk-overlap 400
+import argparse
+import random
+import time
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from backend.text_splitter import OffsetTextSplitter
+
+WORDS = ["alpha", "beta", "gamma", "delta", "matrix", "vector", "theorem", "proof", "lemma", "course",
+         "student", "energy", "photosynthesis", "derivative", "integral", "equilibrium"]
+
+def make_corpus(pages: int, lines: int = 45, words: int = 14, seed: int = 0) -> list:
+    # Roughly the density of a text book page: paragraphs of wrapped lines separated by blank lines
+    rnd = random.Random(seed)
+    docs = []
+    for page in range(pages):
+        text_lines = []
+        for line in range(lines):
+            text_lines.append(" ".join(rnd.choice(WORDS) for _ in range(words)))
+            if rnd.random() < 0.15:
+                text_lines.append("")
+        docs.append(Document(page_content="\n".join(text_lines), metadata={"source": "synthetic.pdf", "page": page}))
+    return docs
+
+def run(splitter, docs: list) -> tuple:
+    start = time.perf_counter()
+    splits = [split for doc in docs for split in splitter.split_documents([doc])]
+    return splits, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OffsetTextSplitter against RecursiveCharacterTextSplitter")
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--chunk-overlap', type=int, default=400)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    docs = make_corpus(args.pages)
+    splitters = {
+        "RecursiveCharacterTextSplitter": RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, add_start_index=True),
+        "OffsetTextSplitter": OffsetTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, add_start_index=True),
+    }
+    results = {}
+    for name, splitter in splitters.items():
+        # Keep the best of a few runs to reduce noise
+        runs = [run(splitter, docs) for _ in range(args.repeat)]
+        results[name] = (runs[0][0], min(elapsed for _, elapsed in runs))
+
+    baseline, native = results["RecursiveCharacterTextSplitter"][0], results["OffsetTextSplitter"][0]
+    if [split.page_content for split in baseline] != [split.page_content for split in native]:
+        raise SystemExit("Splitters produced different chunks")
+    print(f"{len(docs)} pages, {len(native)} chunks, identical output")
+    for name, (splits, elapsed) in results.items():
+        print(f"{name:32} {elapsed:8.3f}s {len(docs) / elapsed:10.0f} pages/s {len(splits) / elapsed:10.0f} chunks/s")
+    speedup = results["RecursiveCharacterTextSplitter"][1] / results["OffsetTextSplitter"][1]
+    print(f"speedup {speedup:.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import time
+import unittest
+from backend.cache import LRUCache, AnswerCache
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used_by_count(self):
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # "b" is now the least recently used
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_evicts_by_size(self):
+        cache = LRUCache(max_entries=10, max_size=10, size_of=len)
+        cache.put("a", "xxxx")
+        cache.put("b", "xxxx")
+        cache.put("c", "xxxx")
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.size, 8)
+        # Putting a key again refreshes its size
+        cache.put("b", "x")
+        self.assertEqual(cache.size, 5)
+
+    def test_expired_entries_are_misses(self):
+        cache = LRUCache(max_entries=10, ttl=0.01)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["expirations"]), (1, 1, 1))
+        self.assertEqual(stats["entries"], 0)
+
+    def test_pop_invalidates(self):
+        cache = LRUCache(max_entries=10)
+        cache.put("a", 1)
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertIsNone(cache.get("a"))
+
+class TestAnswerCache(unittest.TestCase):
+    def test_exact_and_similar_questions(self):
+        cache = AnswerCache(max_entries=10, similarity=0.9)
+        scope = ("assistant", "persona", "llama3")
+        cache.put(scope, "what is a lemma?", [1.0, 0.0], "A helper theorem.")
+        self.assertEqual(cache.get(scope, "what is a lemma?"), "A helper theorem.")
+        self.assertIsNone(cache.get(("assistant", "persona", "mistral"), "what is a lemma?"))
+        self.assertEqual(cache.get_similar(scope, [0.99, 0.1]), "A helper theorem.")
+        self.assertIsNone(cache.get_similar(scope, [0.5, 0.5]))
+        stats = cache.stats()
+        self.assertEqual((stats["exact_hits"], stats["semantic_hits"], stats["misses"]), (1, 1, 1))
+
+    def test_distinct_questions_do_not_collide_without_a_threshold(self):
+        cache = AnswerCache(max_entries=10)
+        scope = ("assistant", "persona", "llama3")
+        # An LLM embedder scores different questions on the same topic about this close
+        cache.put(scope, "what is a derivative?", [1.0, 0.01], "The rate of change.")
+        self.assertIsNone(cache.get(scope, "what is an integral?"))
+        self.assertIsNone(cache.get_similar(scope, [1.0, 0.02]))
+        self.assertEqual(cache.get(scope, "what is a derivative?"), "The rate of change.")
+        stats = cache.stats()
+        self.assertEqual((stats["exact_hits"], stats["semantic_hits"], stats["misses"]), (1, 0, 1))
+
+    def test_invalidate_drops_every_scope_of_the_assistant(self):
+        cache = AnswerCache(max_entries=10)
+        cache.put(("a", "p1", "m"), "q", [1.0], "answer")
+        cache.put(("a", "p2", "m"), "q", [1.0], "answer")
+        cache.put(("b", "p1", "m"), "q", [1.0], "answer")
+        cache.invalidate("a")
+        self.assertIsNone(cache.get(("a", "p1", "m"), "q"))
+        self.assertIsNone(cache.get(("a", "p2", "m"), "q"))
+        self.assertEqual(cache.get(("b", "p1", "m"), "q"), "answer")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import json
+import asyncio
+import tempfile
+import unittest
+from types import SimpleNamespace
+from uuid import uuid4
+from unittest.mock import patch
+import chromadb
+from sqlalchemy import delete, select
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake import FakeListLLM, FakeStreamingListLLM
+from backend.api.MessagesView import MessagesView
+from backend.cache import AnswerCache
+from backend.db import db_session_context
+from backend.embeddings import EmbeddingCache
+from backend.managers import ResourcesManager, PersonasManager
+from backend.managers.MessagesManager import MessagesManager
+from backend.managers.RagManager import RagManager
+from backend.models import Conversation, Message
+from backend.utils import get_current_timestamp
+
+class TopicEmbeddings(Embeddings):
+    # Embeds every text alike, the way an LLM embedder scores different questions on one topic
+    def __init__(self):
+        self.queries = []
+
+    def embed_documents(self, texts):
+        return [[1.0] * 16 for _ in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [1.0] * 16
+
+class TestChat(unittest.TestCase):
+    def asyncTest(func):
+        def wrapper(*args, **kwargs):
+            return asyncio.run(func(*args, **kwargs))
+        return wrapper
+
+    def setUp(self):
+        self.rm = RagManager()
+        client = chromadb.EphemeralClient()
+        self.embeddings = TopicEmbeddings()
+
+        async def initialize_chroma(collection_name):
+            return Chroma(client=client, collection_name=collection_name, embedding_function=self.rm._get_embeddings())
+
+        async def retrieve_resource(_, id):
+            return SimpleNamespace(persona_id="persona")
+
+        async def retrieve_persona(_, id):
+            return SimpleNamespace(name="Tutor", description="Mathematics")
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        for patcher in [patch.object(self.rm, "initialize_chroma", initialize_chroma),
+                        # A fresh cache, configured as by default
+                        patch.object(self.rm, "_answers", AnswerCache(10, similarity=self.rm._answers.similarity)),
+                        patch.object(self.rm, "answer_cache_enabled", True),
+                        patch.object(self.rm, "hybrid_retrieval", False),
+                        patch.object(ResourcesManager, "retrieve_resource", retrieve_resource),
+                        patch.object(PersonasManager, "retrieve_persona", retrieve_persona)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ["_embedding_cache", "_batched_embeddings", "_embeddings"]:
+            self.addCleanup(setattr, self.rm, name, getattr(self.rm, name))
+        self.rm.configure_embeddings(self.embeddings, EmbeddingCache(f"{tmp_dir.name}/embeddings.db"))
+
+    async def ask(self, llm, query):
+        return (await self.rm.retrieve_and_generate_chat_context("assistant", query, llm))["answer"]
+
+    @asyncTest
+    async def test_distinct_questions_get_their_own_answers(self):
+        llm = FakeListLLM(responses=["The rate of change.", "The area under the curve."])
+        self.assertEqual(await self.ask(llm, "What is a derivative?"), "The rate of change.")
+        self.assertEqual(await self.ask(llm, "What is an integral?"), "The area under the curve.")
+        # Asked again, the first question is answered from the cache
+        self.assertEqual(await self.ask(llm, "what is a  derivative?"), "The rate of change.")
+        self.assertEqual(llm.i, 0)  # cycled through both responses once, no third generation
+        stats = self.rm.answer_cache_stats()
+        self.assertEqual((stats["exact_hits"], stats["semantic_hits"], stats["misses"]), (1, 0, 2))
+
+    @asyncTest
+    async def test_keyword_lookups_are_not_embedded_for_the_answer_cache(self):
+        answer_embeddings = TopicEmbeddings()
+        with patch.object(self.rm, "_answers", AnswerCache(10, similarity=0.9)), \
+             patch.object(self.rm, "_answer_embeddings", answer_embeddings):
+            llm = FakeListLLM(responses=["The syllabus.", "Calculus."])
+            self.assertEqual(await self.ask(llm, "CS101 syllabus"), "The syllabus.")
+            self.assertEqual(answer_embeddings.queries, [])
+            self.assertEqual(await self.ask(llm, "What does CS101 cover?"), "Calculus.")
+            self.assertEqual(answer_embeddings.queries, ["What does CS101 cover?"])
+
+    async def stream(self, llm, conversation_id):
+        # Posts a message to the streaming endpoint and parses the server-sent events it answers with
+        async def get_llm_name(_, assistant_id):
+            return "fake", None
+
+        with patch.object(MessagesManager, "__get_llm_name__", get_llm_name), \
+             patch.object(MessagesManager, "_create_llm", lambda _, model_name: llm):
+            response = await MessagesView().stream({"assistant_id": "assistant", "conversation_id": conversation_id,
+                                                    "prompt": "What is a derivative?", "voice_active": "False"})
+            self.assertEqual(response.media_type, "text/event-stream")
+            frames = [frame async for frame in response.body_iterator]
+        events = []
+        for frame in frames:
+            self.assertTrue(frame.endswith("\n\n"))
+            event, data = frame[:-2].split("\n")
+            self.assertTrue(event.startswith("event: ") and data.startswith("data: "))
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return events
+
+    async def conversation(self) -> str:
+        conversation_id = f"test-{uuid4()}"
+        timestamp = get_current_timestamp()
+        async with db_session_context() as session:
+            session.add(Conversation(id=conversation_id, name="Streaming", created_timestamp=timestamp,
+                                     last_updated_timestamp=timestamp, archive="False", assistant_id="assistant",
+                                     user_id="test-user"))
+        self.addCleanup(self.rm.invalidate_chat_history, conversation_id)
+        self.addCleanup(lambda: asyncio.run(self.delete_conversation(conversation_id)))
+        return conversation_id
+
+    async def delete_conversation(self, conversation_id: str):
+        async with db_session_context() as session:
+            await session.execute(delete(Message).where(Message.conversation_id == conversation_id))
+            await session.execute(delete(Conversation).where(Conversation.id == conversation_id))
+
+    async def saved_messages(self, conversation_id: str) -> list:
+        async with db_session_context() as session:
+            result = await session.execute(select(Message).where(Message.conversation_id == conversation_id))
+            return result.scalars().all()
+
+    @asyncTest
+    async def test_answer_is_streamed_as_events_and_saved(self):
+        conversation_id = await self.conversation()
+        events = await self.stream(FakeStreamingListLLM(responses=["The rate of change."]), conversation_id)
+        # Token events carry the answer in order, and a single done event comes last once it has been saved
+        self.assertEqual([event for event, _ in events], ["token"] * (len(events) - 1) + ["done"])
+        self.assertGreater(len(events), 2)
+        self.assertEqual("".join(data["token"] for _, data in events[:-1]), "The rate of change.")
+        done = events[-1][1]
+        self.assertEqual(done["chat_response"], "The rate of change.")
+        message = await MessagesManager().retrieve_message(done["id"])
+        self.assertEqual((message.conversation_id, message.prompt, message.chat_response),
+                         (conversation_id, "What is a derivative?", "The rate of change."))
+
+    @asyncTest
+    async def test_failure_midway_ends_with_an_error_event(self):
+        conversation_id = await self.conversation()
+        llm = FakeStreamingListLLM(responses=["The rate of change."], error_on_chunk_number=3)
+        events = await self.stream(llm, conversation_id)
+        self.assertEqual([event for event, _ in events], ["token"] * 3 + ["error"])
+        self.assertEqual("".join(data["token"] for _, data in events[:-1]), "The")
+        self.assertIn("error", events[-1][1])
+        # Nothing is saved, or cached, for the partial answer
+        self.assertEqual(await self.saved_messages(conversation_id), [])
+        self.assertEqual(self.rm.answer_cache_stats()["entries"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import time
+import asyncio
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.llms import LLM
+from backend.embeddings import EmbeddingCache
+from backend.managers import ResourcesManager, PersonasManager
+from backend.managers.RagManager import RagManager
+
+class SlowFakeLLM(LLM):
+    # Answers after a fixed delay, like a model server busy generating
+    latency: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs) -> str:
+        time.sleep(self.latency)
+        return "answer"
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs) -> str:
+        await asyncio.sleep(self.latency)
+        return "answer"
+
+class TestChatConcurrency(unittest.TestCase):
+    def asyncTest(func):
+        def wrapper(*args, **kwargs):
+            return asyncio.run(func(*args, **kwargs))
+        return wrapper
+
+    @asyncTest
+    async def test_simultaneous_chats_do_not_block_each_other(self):
+        rm = RagManager()
+        client = chromadb.EphemeralClient()
+        embeddings = (rm._embedding_cache, rm._batched_embeddings, rm._embeddings)
+
+        async def initialize_chroma(collection_name):
+            return Chroma(client=client, collection_name=collection_name, embedding_function=rm._get_embeddings())
+
+        async def retrieve_resource(self, id):
+            return SimpleNamespace(persona_id="persona")
+
+        async def retrieve_persona(self, id):
+            return SimpleNamespace(name="Tutor", description="Mathematics")
+
+        chats, latency = 5, 1.0
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+             patch.object(rm, "initialize_chroma", initialize_chroma), \
+             patch.object(rm, "answer_cache_enabled", False), \
+             patch.object(ResourcesManager, "retrieve_resource", retrieve_resource), \
+             patch.object(PersonasManager, "retrieve_persona", retrieve_persona):
+            try:
+                rm.configure_embeddings(DeterministicFakeEmbedding(size=16), EmbeddingCache(f"{tmp_dir}/embeddings.db"))
+                llm = SlowFakeLLM(latency=latency)
+                # The first chat creates the collection; only the chats after it are timed
+                await rm.retrieve_and_generate_chat_context("assistant", "warm up", llm)
+                start = time.perf_counter()
+                responses = await asyncio.gather(*[
+                    rm.retrieve_and_generate_chat_context("assistant", f"question {i}", llm) for i in range(chats)])
+                elapsed = time.perf_counter() - start
+            finally:
+                rm._embedding_cache, rm._batched_embeddings, rm._embeddings = embeddings
+
+        self.assertEqual([response["answer"] for response in responses], ["answer"] * chats)
+        # Concurrent chats take about as long as the slowest one, not the sum of all of them
+        self.assertLess(elapsed, latency * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+from uuid import uuid4
+from sqlalchemy import delete
+from backend.db import db_session_context
+from backend.models import Message
+from backend.managers.RagManager import RagManager
+from backend.managers.MessagesManager import MessagesManager
+
+class TestChatHistory(unittest.TestCase):
+    def setUp(self):
+        self.rm = RagManager()
+        self.conversation_id = str(uuid4())
+
+    def asyncTest(func):
+        def wrapper(*args, **kwargs):
+            return asyncio.run(func(*args, **kwargs))
+        return wrapper
+
+    async def save_turn(self, i: int):
+        await MessagesManager().save_message({
+            "assistant_id": "assistant", "conversation_id": self.conversation_id,
+            "timestamp": f"2024-01-01T00:00:{i:02d}Z", "prompt": f"question {i}",
+            "chat_response": f"answer {i}", "voice_active": "False"
+        })
+
+    async def cleanup(self):
+        self.rm.invalidate_chat_history(self.conversation_id)
+        async with db_session_context() as session:
+            await session.execute(delete(Message).where(Message.conversation_id == self.conversation_id))
+
+    @asyncTest
+    async def test_history_is_loaded_and_windowed(self):
+        try:
+            for i in range(self.rm.chat_history_window + 2):
+                await self.save_turn(i)
+            history = await self.rm.get_chat_history(self.conversation_id)
+            self.assertEqual(len(history), 2 * self.rm.chat_history_window)
+            self.assertEqual(history[0].content, "question 2")
+            self.assertEqual(history[-1].content, f"answer {self.rm.chat_history_window + 1}")
+        finally:
+            await self.cleanup()
+
+    @asyncTest
+    async def test_saved_messages_are_appended_to_the_cached_window(self):
+        try:
+            await self.save_turn(0)
+            self.assertEqual(len(await self.rm.get_chat_history(self.conversation_id)), 2)
+            await self.save_turn(1)
+            history = await self.rm.get_chat_history(self.conversation_id)
+            self.assertEqual([m.content for m in history], ["question 0", "answer 0", "question 1", "answer 1"])
+            # The chain writes to a copy, not to the cached window
+            self.rm.get_session_history(history).add_user_message("not saved")
+            self.assertEqual(len(await self.rm.get_chat_history(self.conversation_id)), 4)
+        finally:
+            await self.cleanup()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+from langchain_core.documents import Document
+from backend.context import merge_overlaps, pack_context
+
+PAGE = " ".join(f"word{i}" for i in range(200))
+
+def chunk(doc_id: str, start: int, end: int, page: str = "page-1") -> Document:
+    return Document(id=doc_id, page_content=PAGE[start:end], metadata={"original_id": page, "start_index": start})
+
+class TestContextPacking(unittest.TestCase):
+    def test_overlapping_chunks_are_merged_in_place_of_the_best_ranked(self):
+        docs = [chunk("other", 0, 100, page="page-2"), chunk("second", 300, 700), chunk("first", 0, 400)]
+        merged = merge_overlaps(docs)
+        self.assertEqual([doc.id for doc in merged], ["other", "first"])
+        self.assertEqual(merged[1].page_content, PAGE[0:700])
+
+    def test_separate_chunks_are_kept(self):
+        docs = [chunk("a", 0, 100), chunk("b", 500, 600)]
+        self.assertEqual([doc.page_content for doc in merge_overlaps(docs)], [PAGE[0:100], PAGE[500:600]])
+
+    def test_budget_cuts_the_last_document_at_a_word(self):
+        docs = [Document(page_content="x" * 400), Document(page_content=PAGE), Document(page_content="y" * 40)]
+        packed = pack_context(docs, token_budget=200, min_tokens=10)
+        self.assertEqual(len(packed), 2)
+        self.assertLessEqual(sum(len(doc.page_content) for doc in packed), 800)
+        self.assertTrue(PAGE.startswith(packed[1].page_content + " "))
+
+if __name__ == '__main__':
+    unittest.main()
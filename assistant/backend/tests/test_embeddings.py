@@ -0,0 +1,100 @@
+import tempfile
+import unittest
+from pathlib import Path
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from backend.cache import LRUCache
+from backend.embeddings import EmbeddingCache, CachedEmbeddings, BatchedEmbeddings, text_hash
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: list = []
+    queries: list = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+class FlakyEmbeddings(CountingEmbeddings):
+    fail_on_calls: set = set()
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        if len(self.calls) in self.fail_on_calls:
+            raise ConnectionError("embedding backend unavailable")
+        return DeterministicFakeEmbedding.embed_documents(self, texts)
+
+class TestCachedEmbeddings(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = EmbeddingCache(Path(self.tmp_dir.name) / 'cache.db', max_entries=10)
+        self.embedder = CountingEmbeddings(size=8, calls=[], queries=[])
+        self.embeddings = CachedEmbeddings(self.embedder, self.cache, 'fake-model')
+
+    def test_cached_texts_are_not_embedded_again(self):
+        first = self.embeddings.embed_documents(["a", "b"])
+        second = self.embeddings.embed_documents(["b", "c", "a"])
+        self.assertEqual(self.embedder.calls, [["a", "b"], ["c"]])
+        # Vectors are stored as float32, so compare approximately
+        for cached, fresh in zip(second[0], first[1]):
+            self.assertAlmostEqual(cached, fresh, places=5)
+        self.assertEqual(self.cache.stats()["hits"], 2)
+        self.assertEqual(self.cache.stats()["misses"], 3)
+
+    def test_cache_is_keyed_by_model(self):
+        self.embeddings.embed_documents(["a"])
+        CachedEmbeddings(self.embedder, self.cache, 'other-model').embed_documents(["a"])
+        self.assertEqual(self.embedder.calls, [["a"], ["a"]])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.embeddings.embed_documents([str(i) for i in range(10)])
+        self.cache.get_many('fake-model', [text_hash("0")])  # touch "0" so it survives eviction
+        self.embeddings.embed_documents(["new"])
+        self.assertLessEqual(self.cache.stats()["entries"], 10)
+        self.assertIsNotNone(self.cache.get_many('fake-model', [text_hash("0")])[0])
+        self.assertIsNone(self.cache.get_many('fake-model', [text_hash("1")])[0])
+
+    def test_repeated_queries_skip_the_embedder(self):
+        embeddings = CachedEmbeddings(self.embedder, self.cache, 'fake-model', LRUCache(max_entries=10, ttl=60))
+        first = embeddings.embed_query("What is  a Vector?")
+        second = embeddings.embed_query("what is a vector? ")
+        self.assertEqual(first, second)
+        self.assertEqual(self.embedder.queries, ["What is  a Vector?"])
+        self.assertEqual(embeddings.query_cache.stats()["hits"], 1)
+
+    def test_queries_are_embedded_as_asked(self):
+        embeddings = CachedEmbeddings(self.embedder, self.cache, 'fake-model', LRUCache(max_entries=10, ttl=60))
+        embeddings.embed_query("CS101 Straße")
+        self.assertEqual(self.embedder.queries, ["CS101 Straße"])
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+class TestBatchedEmbeddings(unittest.TestCase):
+    def test_batches_grow_and_preserve_order(self):
+        embedder = CountingEmbeddings(size=8, calls=[])
+        batched = BatchedEmbeddings(embedder, batch_size=2, max_batch_size=8)
+        texts = [str(i) for i in range(20)]
+        self.assertEqual(batched.embed_documents(texts), embedder.embed_documents(texts))
+        self.assertEqual([len(call) for call in embedder.calls[:2]], [2, 4])
+        self.assertIn(2, batched.stats()["chunks_per_sec"])
+
+    def test_failed_batch_is_retried_without_redoing_earlier_batches(self):
+        embedder = FlakyEmbeddings(size=8, calls=[], fail_on_calls={2})
+        batched = BatchedEmbeddings(embedder, batch_size=4, max_batch_size=4, retry_delay=0)
+        vectors = batched.embed_documents([str(i) for i in range(8)])
+        self.assertEqual(len(vectors), 8)
+        self.assertEqual(embedder.calls, [["0", "1", "2", "3"], ["4", "5", "6", "7"], ["4", "5"], ["6", "7"]])
+        self.assertEqual(batched.stats()["errors"], 1)
+
+    def test_gives_up_after_max_retries(self):
+        embedder = FlakyEmbeddings(size=8, calls=[], fail_on_calls={1, 2, 3})
+        batched = BatchedEmbeddings(embedder, batch_size=4, max_retries=2, retry_delay=0)
+        with self.assertRaises(ConnectionError):
+            batched.embed_documents(["a", "b"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,439 @@
+import io
+import hashlib
+import asyncio
+import weakref
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Optional
+from unittest.mock import patch
+from uuid import uuid4
+import chromadb
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from sqlalchemy import delete, select, text
+from starlette.datastructures import UploadFile
+from backend.cache import LRUCache
+from backend.db import db_session_context
+from backend.embeddings import EmbeddingCache
+from backend.ingestion import FileProgress
+from backend.managers.RagManager import RagManager, FileStatus, _write_upload
+from backend.managers.IndexingJobsManager import IndexingJobsManager, JobStatus
+from backend.models import File, Page, Chunk, IndexingJob
+from backend.pdf import load_pdf
+from backend.tests.bench_ingestion import SlowFakeEmbeddings, make_pdf, write_pdf
+
+async def no_flush(file_id, **values):
+    pass
+
+def page_texts(docs):
+    return [(doc.page_content, doc.metadata.get("page")) for doc in docs]
+
+class CrashingEmbeddings(DeterministicFakeEmbedding):
+    # Fails every request after the first crash_after ones, like an embedding server that went away
+    crash_after: Optional[int] = None
+    requests: int = 0
+
+    def embed_documents(self, texts):
+        self.requests += 1
+        if self.crash_after is not None and self.requests > self.crash_after:
+            raise ConnectionError("embedding backend unavailable")
+        return super().embed_documents(texts)
+
+class TestIndexing(unittest.TestCase):
+    def asyncTest(func):
+        def wrapper(*args, **kwargs):
+            return asyncio.run(func(*args, **kwargs))
+        return wrapper
+
+    def setUp(self):
+        self.rm = RagManager()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_pdf(self, name: str, pages: int, seed: int = 0) -> str:
+        path = Path(self.tmp_dir.name) / name
+        make_pdf(path, pages, lines=5, words=8, seed=seed)
+        return str(path)
+
+    async def collect(self, batches) -> list:
+        return [doc async for batch in batches for doc in batch]
+
+    @asyncTest
+    async def test_pdfs_are_parsed_in_parallel_in_spawned_workers(self):
+        paths = [self.make_pdf(f"{i}.pdf", pages=3, seed=i) for i in range(2)]
+        progresses = [FileProgress(str(i), no_flush) for i in range(2)]
+        with patch.object(self.rm, "index_parse_workers", 2), \
+             patch.object(self.rm, "_parse_semaphore", asyncio.Semaphore(2)):
+            try:
+                parsed = await asyncio.gather(*[self.collect(self.rm._load_pdf_batches(path, progress))
+                                                for path, progress in zip(paths, progresses)])
+                self.assertEqual(self.rm._get_parse_executor()._mp_context.get_start_method(), "spawn")
+            finally:
+                self.rm.shutdown()
+        self.assertIsNone(self.rm._parse_executor)
+        for path, docs, progress in zip(paths, parsed, progresses):
+            self.assertEqual(page_texts(docs), page_texts(load_pdf(path)))
+            self.assertEqual(progress.pages_total, 3)
+
+    @asyncTest
+    async def test_streamed_batches_match_the_whole_file_parse(self):
+        path = self.make_pdf("streamed.pdf", pages=5)
+        progress = FileProgress("streamed", no_flush)
+        with patch.object(self.rm, "index_batch_pages", 2):
+            batches = [batch async for batch in self.rm._stream_pdf_batches(path, progress)]
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(page_texts([doc for batch in batches for doc in batch]), page_texts(load_pdf(path)))
+        self.assertEqual(progress.pages_total, 5)
+
+    def test_only_recent_ingestion_metrics_are_kept(self):
+        with patch.object(self.rm, "ingestion_metrics", LRUCache(2)):
+            for file_id in ["a", "b", "c"]:
+                metrics = self.rm._start_ingestion_metrics(file_id)
+                self.assertNotIn(file_id, self.rm.ingestion_metrics)
+                self.rm._sample_rss(metrics)
+                self.rm._log_ingestion_metrics(file_id, metrics)
+            self.assertEqual([file_id for file_id, _ in self.rm.ingestion_metrics.items()], ["b", "c"])
+            metrics = self.rm.ingestion_metrics.get("c")
+        self.assertEqual(metrics["process_rss_growth"], metrics["process_peak_rss"] - metrics["process_start_rss"])
+        self.assertGreaterEqual(metrics["process_rss_growth"], 0)
+
+    @asyncTest
+    async def test_collections_are_released_once_over_the_memory_limit(self):
+        # Three collections of 10 vectors, about 1.6kB each; two fit in the limit
+        with patch.object(self.rm, "_chroma_client", None), \
+             patch.object(self.rm, "chroma_db_path", Path(self.tmp_dir.name) / "chroma_db"), \
+             patch.object(self.rm, "chroma_memory_limit", 4000), \
+             patch.object(self.rm, "_embeddings", DeterministicFakeEmbedding(size=8)), \
+             patch.object(self.rm, "_vectorstores", LRUCache(32)), \
+             patch.object(self.rm, "_footprints", {}), \
+             patch.object(self.rm, "_handed_out", weakref.WeakSet()), \
+             patch.object(self.rm, "chroma_client_releases", 0):
+            client = self.rm._get_chroma_client()
+            for name in ["alpha", "beta", "gamma"]:
+                client.create_collection(name).add(ids=[f"{name}-{i}" for i in range(10)], documents=[name] * 10,
+                                                   embeddings=[[float(i)] * 8 for i in range(10)])
+            try:
+                alpha = await self.rm.initialize_chroma("alpha")
+                await self.rm.initialize_chroma("beta")
+                self.assertEqual(self.rm.vectorstore_stats()["estimated_bytes"], 2 * 10 * (8 * 4 + 128))
+                alpha.similarity_search_by_vector([1.0] * 8, k=1)
+
+                # alpha is still being used, so the client can't be closed yet
+                await self.rm.initialize_chroma("gamma")
+                self.assertIs(self.rm._chroma_client, client)
+                self.assertEqual(self.rm.vectorstore_stats()["client_releases"], 0)
+
+                # Once it isn't, the next collection opened closes the client and unloads the others
+                del alpha
+                self.rm.invalidate_vectorstore("gamma")
+                gamma = await self.rm.initialize_chroma("gamma")
+                self.assertIsNot(self.rm._chroma_client, client)
+                self.assertFalse(hasattr(client._server, "bindings"))
+                stats = self.rm.vectorstore_stats()
+                self.assertEqual((stats["client_releases"], stats["entries"], stats["estimated_bytes"]), (1, 1, 10 * (8 * 4 + 128)))
+                self.assertEqual(len(gamma.similarity_search_by_vector([1.0] * 8, k=3)), 3)
+            finally:
+                self.rm._chroma_client.close()
+
+    def counted_writes(self, writes: list):
+        # open() for the upload writer, recording the size of every write to the file
+        def counting_open(path, mode):
+            file = open(path, mode)
+            write = file.write
+            file.write = lambda data: writes.append(len(data)) or write(data)
+            return file
+        return patch('backend.managers.RagManager.open', counting_open, create=True)
+
+    @asyncTest
+    async def test_uploads_are_copied_with_a_single_write(self):
+        data = bytes(range(256)) * 4096
+        # Spooled in memory, and rolled over to a temporary file on disk
+        for max_size in (len(data) + 1, 1024):
+            spooled = tempfile.SpooledTemporaryFile(max_size=max_size)
+            spooled.write(data)
+            writes = []
+            with spooled, self.counted_writes(writes):
+                path, content_hash = await self.rm.save_file(UploadFile(spooled, filename=f"{max_size}.bin"), Path(self.tmp_dir.name))
+            self.assertEqual(writes, [len(data)])
+            self.assertEqual(Path(path).read_bytes(), data)
+            self.assertEqual(content_hash, hashlib.sha256(data).hexdigest())
+
+    def test_unmappable_uploads_are_copied_in_reads(self):
+        data = b"0123456789" * 100
+        source = io.BufferedReader(io.BytesIO(data))  # no buffer to borrow and no file descriptor to map
+        path = Path(self.tmp_dir.name) / "read.bin"
+        writes = []
+        with self.counted_writes(writes):
+            content_hash = _write_upload(source, path, read_size=256)
+        self.assertEqual(writes, [256, 256, 256, 232])
+        self.assertEqual(path.read_bytes(), data)
+        self.assertEqual(content_hash, hashlib.sha256(data).hexdigest())
+
+class TestIndexedFiles(unittest.TestCase):
+    # Indexes real PDFs end to end: rows go to the database under a throwaway assistant id, vectors to an
+    # in-memory Chroma client and uploads to a temporary directory, all removed afterwards
+    def asyncTest(func):
+        def wrapper(*args, **kwargs):
+            return asyncio.run(func(*args, **kwargs))
+        return wrapper
+
+    def setUp(self):
+        self.rm = RagManager()
+        self.resource_id = f"test-{uuid4()}"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_path = Path(self.tmp_dir.name)
+        embeddings = (self.rm._embedding_cache, self.rm._batched_embeddings, self.rm._embeddings)
+        self.rm.configure_embeddings(DeterministicFakeEmbedding(size=16), EmbeddingCache(self.tmp_path / 'embeddings.db'))
+        self.addCleanup(self.restore_embeddings, embeddings)
+        for patcher in [patch('backend.managers.RagManager.uploads_dir', self.tmp_path / 'uploads'),
+                        patch.object(self.rm, '_chroma_client', chromadb.EphemeralClient())]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        asyncio.run(self.cleanup())
+        self.tmp_dir.cleanup()
+
+    def restore_embeddings(self, embeddings):
+        self.rm._embedding_cache, self.rm._batched_embeddings, self.rm._embeddings = embeddings
+
+    async def cleanup(self):
+        self.rm.invalidate_vectorstore(self.resource_id)
+        if self.resource_id in [collection.name for collection in self.rm._chroma_client.list_collections()]:
+            self.rm._chroma_client.delete_collection(self.resource_id)
+        async with db_session_context() as session:
+            for model in (Chunk, Page, File, IndexingJob):
+                await session.execute(delete(model).where(model.assistant_id == self.resource_id))
+            await session.execute(text("DELETE FROM chunk_fts WHERE assistant_id = :assistant_id"),
+                                  {"assistant_id": self.resource_id})
+
+    def pdf_bytes(self, pages: int, seed: int = 0) -> bytes:
+        path = self.tmp_path / f"source-{uuid4()}.pdf"
+        make_pdf(path, pages, lines=5, words=8, seed=seed)
+        return path.read_bytes()
+
+    def pages_pdf_bytes(self, *texts: str) -> bytes:
+        # One line of text per page
+        path = self.tmp_path / f"source-{uuid4()}.pdf"
+        write_pdf(path, [[text] for text in texts])
+        return path.read_bytes()
+
+    def upload(self, name: str, data: bytes) -> UploadFile:
+        return UploadFile(io.BytesIO(data), filename=name)
+
+    async def files(self) -> list:
+        async with db_session_context() as session:
+            return (await session.execute(select(File).filter(File.assistant_id == self.resource_id))).scalars().all()
+
+    async def index_counts(self) -> dict:
+        # Pages, chunks, full-text rows and vectors stored for the assistant
+        async with db_session_context() as session:
+            counts = {model.__tablename__: len((await session.execute(
+                select(model.id).filter(model.assistant_id == self.resource_id))).all()) for model in (Page, Chunk)}
+            counts["chunk_fts"] = len((await session.execute(
+                text("SELECT chunk_id FROM chunk_fts WHERE assistant_id = :assistant_id"),
+                {"assistant_id": self.resource_id})).all())
+        vectorstore = await self.rm.initialize_chroma(self.resource_id)
+        counts["vectors"] = len(vectorstore.get(include=[])["ids"])
+        return counts
+
+    async def wait_for(self, condition, timeout: float = 30):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not await condition():
+            self.assertLess(asyncio.get_running_loop().time(), deadline, "timed out")
+            await asyncio.sleep(0.02)
+
+    @asyncTest
+    async def test_reuploading_identical_bytes_reuses_the_indexed_file(self):
+        data = self.pdf_bytes(pages=2)
+        first = await self.rm.upload_file(self.resource_id, [self.upload("notes.pdf", data)])
+        indexed = await self.index_counts()
+        self.assertEqual(indexed["page"], 2)
+        with patch.object(self.rm, "create_index", wraps=self.rm.create_index) as create_index:
+            second = await self.rm.upload_file(self.resource_id, [self.upload("notes (copy).pdf", data)])
+        create_index.assert_not_called()
+        self.assertEqual([(page["file_id"], page["page_id"]) for page in second],
+                         [(page["file_id"], page["page_id"]) for page in first])
+        self.assertTrue(all(page["duplicate"] for page in second))
+        self.assertEqual(len(await self.files()), 1)
+        self.assertEqual(await self.index_counts(), indexed)
+
+    @asyncTest
+    async def test_files_that_did_not_finish_indexing_are_not_duplicates(self):
+        data = self.pdf_bytes(pages=1)
+        for status in (FileStatus.FAILED, FileStatus.INDEXING):
+            file_id = str(uuid4())
+            await self.rm.create_file(file_id, self.resource_id, "notes.pdf", status.value)
+            await self.rm.update_file(file_id, content_hash=hashlib.sha256(data).hexdigest())
+        files_to_index, duplicates = await self.rm.save_uploads(self.resource_id, [self.upload("notes.pdf", data)])
+        self.assertEqual(len(files_to_index), 1)
+        self.assertEqual(duplicates, [])
+
+    @asyncTest
+    async def test_job_interrupted_by_a_shutdown_resumes_on_the_next_start(self):
+        jobs = IndexingJobsManager()
+        # A slow embedder and one page per window, so the shutdown lands between checkpoints
+        self.rm.configure_embeddings(SlowFakeEmbeddings(size=16, request_latency=0.1), EmbeddingCache(self.tmp_path / 'slow.db'))
+        with patch.object(self.rm, "index_batch_pages", 1), patch.object(self.rm, "index_flush_chunks", 1):
+            files_to_index, _ = await self.rm.save_uploads(self.resource_id, [self.upload("notes.pdf", self.pdf_bytes(pages=6))])
+            file_id, upload = files_to_index[0]["file_id"], Path(files_to_index[0]["path"])
+
+            async def checkpointed():
+                progress = self.rm.progress.get(file_id)
+                return progress is not None and progress.checkpoint_page is not None
+
+            async def finished():
+                return (await jobs.retrieve_job(job_id)).status in (JobStatus.DONE.value, JobStatus.FAILED.value)
+
+            try:
+                job_id = await jobs.enqueue_job(self.resource_id, files_to_index)
+                await self.wait_for(checkpointed)
+                await jobs.shutdown()
+                self.assertTrue(upload.exists())
+                self.assertEqual((await jobs.retrieve_job(job_id)).status, JobStatus.RUNNING.value)
+                self.assertLess((await self.index_counts())["vectors"], 6)
+
+                await jobs.start()
+                await self.wait_for(finished)
+            finally:
+                await jobs.shutdown()
+
+        job = await jobs.retrieve_job(job_id)
+        self.assertEqual(job.status, JobStatus.DONE.value)
+        self.assertEqual(job.attempts, 2)
+        self.assertFalse(upload.exists())
+        self.assertEqual((await self.rm.retrieve_file(file_id))[0].indexing_status, FileStatus.DONE.value)
+        counts = await self.index_counts()
+        self.assertEqual(counts["page"], 6)
+        self.assertEqual(counts["vectors"], counts["chunk"])
+        self.assertEqual(counts["chunk_fts"], counts["chunk"])
+
+    @asyncTest
+    async def test_reindexing_keeps_unchanged_and_moved_pages(self):
+        pages = {name: f"page {name} about the {name} theorem" for name in ["alpha", "beta", "gamma", "delta", "omega"]}
+        indexed = await self.rm.upload_file(self.resource_id, [self.upload("notes.pdf", self.pages_pdf_bytes(
+            pages["alpha"], pages["beta"], pages["gamma"], pages["delta"]))])
+        file_id = indexed[0]["file_id"]
+        page_ids = [page.id for page in await self.rm.retrieve_pages(file_id)]
+
+        # alpha stays, gamma and beta move, delta is replaced by omega
+        jobs = IndexingJobsManager()
+        try:
+            result = await jobs.reindex_file(self.resource_id, file_id, self.upload("notes.pdf", self.pages_pdf_bytes(
+                pages["alpha"], pages["gamma"], pages["omega"], pages["beta"])))
+        finally:
+            await jobs.shutdown()
+        self.assertEqual(result, {"file_id": file_id, "pages_unchanged": 3, "pages_added": 1, "pages_removed": 1})
+
+        stored = {page.id: page for page in await self.rm.retrieve_pages(file_id)}
+        self.assertEqual(len(stored), 4)
+        self.assertEqual(len(set(page_ids) & set(stored)), 3)
+        await self.assert_pages_agree(file_id, {"alpha": 0, "gamma": 1, "omega": 2, "beta": 3})
+
+    async def assert_pages_agree(self, file_id: str, order: dict):
+        # Every copy of a chunk's page number agrees with its page row and with where its text now is
+        stored = {page.id: page for page in await self.rm.retrieve_pages(file_id)}
+        vectorstore = await self.rm.initialize_chroma(self.resource_id)
+        vectors = vectorstore.get(include=["metadatas", "documents"])
+        self.assertEqual(len(vectors["ids"]), len(order))
+        for metadata, document in zip(vectors["metadatas"], vectors["documents"]):
+            self.assertEqual(metadata["page"], stored[metadata["original_id"]].page_number)
+            self.assertEqual(metadata["page"], order[document.split()[1]])
+        async with db_session_context() as session:
+            fts_rows = (await session.execute(text("SELECT page_id, page_number, text FROM chunk_fts WHERE assistant_id = :assistant_id"),
+                                              {"assistant_id": self.resource_id})).all()
+        self.assertEqual(len(fts_rows), len(order))
+        for row in fts_rows:
+            self.assertEqual(row.page_number, stored[row.page_id].page_number)
+            self.assertEqual(row.page_number, order[row.text.split()[1]])
+
+    @asyncTest
+    async def test_interrupted_reindex_is_redone_on_the_next_start(self):
+        pages = {name: f"page {name} about the {name} theorem" for name in ["alpha", "beta", "gamma", "omega"]}
+        indexed = await self.rm.upload_file(self.resource_id, [self.upload("notes.pdf", self.pages_pdf_bytes(
+            pages["alpha"], pages["beta"], pages["gamma"]))])
+        file_id = indexed[0]["file_id"]
+        revised = self.pages_pdf_bytes(pages["gamma"], pages["omega"], pages["alpha"])
+
+        async def shutdown_while_moving(vectorstore, moved_pages):
+            # The new page is in and the removed one gone, but the moved pages keep their old numbers
+            raise asyncio.CancelledError
+
+        jobs = IndexingJobsManager()
+        try:
+            with patch.object(self.rm, "_move_pages", shutdown_while_moving), self.assertRaises(asyncio.CancelledError):
+                await jobs.reindex_file(self.resource_id, file_id, self.upload("notes.pdf", revised))
+            await jobs.shutdown()
+            [job] = await self.jobs()
+            job_id = job.id
+            self.assertEqual((await jobs.retrieve_job(job_id)).status, JobStatus.RUNNING.value)
+
+            await jobs.start()
+
+            async def finished():
+                return (await jobs.retrieve_job(job_id)).status in (JobStatus.DONE.value, JobStatus.FAILED.value)
+            await self.wait_for(finished)
+        finally:
+            await jobs.shutdown()
+
+        job = await jobs.retrieve_job(job_id)
+        self.assertEqual((job.status, job.attempts), (JobStatus.DONE.value, 2))
+        file = (await self.rm.retrieve_file(file_id))[0]
+        self.assertEqual(file.indexing_status, FileStatus.DONE.value)
+        self.assertEqual(file.content_hash, hashlib.sha256(revised).hexdigest())
+        self.assertFalse((self.tmp_path / 'uploads' / self.resource_id / file_id).exists())
+        await self.assert_pages_agree(file_id, {"gamma": 0, "omega": 1, "alpha": 2})
+
+    async def jobs(self) -> list:
+        async with db_session_context() as session:
+            return (await session.execute(select(IndexingJob).filter(IndexingJob.assistant_id == self.resource_id))).scalars().all()
+
+    async def chunk_ids(self) -> dict:
+        async with db_session_context() as session:
+            chunks = (await session.execute(select(Chunk.id).filter(Chunk.assistant_id == self.resource_id))).scalars().all()
+            fts_rows = (await session.execute(text("SELECT chunk_id FROM chunk_fts WHERE assistant_id = :assistant_id"),
+                                              {"assistant_id": self.resource_id})).scalars().all()
+        vectorstore = await self.rm.initialize_chroma(self.resource_id)
+        return {"chunk": sorted(chunks), "chunk_fts": sorted(fts_rows), "vectors": sorted(vectorstore.get(include=[])["ids"])}
+
+    @asyncTest
+    async def test_resuming_from_a_checkpoint_neither_duplicates_nor_drops_chunks(self):
+        embedder = CrashingEmbeddings(size=16, crash_after=2)
+        self.rm.configure_embeddings(embedder, EmbeddingCache(self.tmp_path / 'crashing.db'))
+        self.rm._batched_embeddings.max_retries = 0
+        # One page per window, so the embedder goes away after two windows
+        with patch.object(self.rm, "index_batch_pages", 1), patch.object(self.rm, "index_flush_chunks", 1):
+            files_to_index, _ = await self.rm.save_uploads(self.resource_id, [self.upload("notes.pdf", self.pdf_bytes(pages=8))])
+            file_id, path = files_to_index[0]["file_id"], files_to_index[0]["path"]
+            with self.assertRaises(ConnectionError):
+                await self.rm.create_index(self.resource_id, [path], [file_id])
+
+            self.assertEqual((await self.rm.retrieve_file(file_id))[0].checkpoint_page, 1)
+            interrupted = await self.index_counts()
+            self.assertGreater(interrupted["page"], 2)  # the store stage runs ahead of the embed stage
+            self.assertEqual(interrupted["vectors"], 2)
+
+            await self.rm.rollback_files(self.resource_id, [file_id])
+            rolled_back = await self.chunk_ids()
+            self.assertEqual(len((await self.rm.retrieve_pages(file_id))), 2)
+            self.assertEqual(rolled_back["chunk_fts"], rolled_back["chunk"])
+            self.assertEqual(rolled_back["vectors"], rolled_back["chunk"])
+
+            embedder.crash_after = None
+            await self.rm.create_index(self.resource_id, [path], [file_id])
+
+        file = (await self.rm.retrieve_file(file_id))[0]
+        self.assertEqual(file.indexing_status, FileStatus.DONE.value)
+        self.assertEqual(sorted(page.page_number for page in await self.rm.retrieve_pages(file_id)), list(range(8)))
+        resumed = await self.chunk_ids()
+        expected_chunks = sum(len(self.rm._get_text_splitter().split_documents([doc])) for doc in load_pdf(path))
+        self.assertEqual(len(resumed["chunk"]), expected_chunks)
+        self.assertTrue(set(rolled_back["chunk"]) <= set(resumed["chunk"]))
+        self.assertEqual(resumed["chunk_fts"], resumed["chunk"])
+        self.assertEqual(resumed["vectors"], resumed["chunk"])
+        self.assertEqual(file.chunks_embedded, len(resumed["chunk"]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+from backend.ingestion import FileProgress, StageQueue, find_bottleneck, run_stages
+
+class TestIngestion(unittest.TestCase):
+    def asyncTest(func):
+        def wrapper(*args, **kwargs):
+            return asyncio.run(func(*args, **kwargs))
+        return wrapper
+
+    @asyncTest
+    async def test_producer_blocks_at_high_water(self):
+        queue = StageQueue('embed', high_water=2)
+        produced = []
+
+        async def produce():
+            for i in range(5):
+                await queue.put(i)
+                produced.append(i)
+            await queue.close()
+
+        async def consume():
+            await asyncio.sleep(0.05)
+            self.assertEqual(produced, [0, 1])  # the third put waits for the consumer
+            items = []
+            while (item := await queue.get()) is not None:
+                items.append(item)
+            return items
+
+        _, items = await asyncio.gather(produce(), consume())
+        self.assertEqual(items, [0, 1, 2, 3, 4])
+        stats = queue.stats()
+        self.assertEqual(stats["items"], 5)
+        self.assertEqual(stats["max_occupancy"], 2)
+        self.assertGreater(stats["put_wait"], 0.04)
+        self.assertEqual(find_bottleneck(['store', 'embed'], [queue]), 'embed')
+
+    @asyncTest
+    async def test_failed_stage_cancels_the_others(self):
+        queue = StageQueue('split', high_water=1)
+
+        async def produce():
+            for i in range(10):
+                await queue.put(i)
+
+        async def fail():
+            await queue.get()
+            raise ValueError("cannot split")
+
+        with self.assertRaises(ValueError):
+            await asyncio.wait_for(run_stages(produce(), fail()), timeout=1)
+
+    @asyncTest
+    async def test_progress_flushes_are_coalesced(self):
+        flushes = []
+
+        async def flush(file_id, **values):
+            flushes.append(values)
+
+        progress = FileProgress('file', flush, flush_interval=60)
+        await progress.set_stage('splitting')
+        for _ in range(100):
+            await progress.advance(pages=1, chunks=2)
+        await progress.close()
+        self.assertEqual(len(flushes), 2)
+        self.assertEqual(flushes[-1]["pages_processed"], 100)
+        self.assertEqual(flushes[-1]["chunks_total"], 200)
+
+if __name__ == '__main__':
+    unittest.main()
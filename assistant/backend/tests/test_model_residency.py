@@ -0,0 +1,129 @@
+import json
+import time
+import asyncio
+import unittest
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from backend.managers.ModelResidencyManager import ModelResidencyManager, parse_duration
+
+GB = 1024 ** 3
+
+class FakeOllama(BaseHTTPRequestHandler):
+    # Just enough of the Ollama API: model sizes, running models, and loading/unloading through empty requests
+    sizes = {"embedder:latest": GB, "a:latest": 3 * GB, "b:latest": 3 * GB, "c:latest": 3 * GB}
+    running = {}
+    requests = []
+    load_delays = {}
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._reply({"models": [{"name": name, "size": size} for name, size in self.sizes.items()]})
+        else:
+            self._reply({"models": [{"name": name, "size": size} for name, size in self.running.items()]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append((self.path, body))
+        if body["keep_alive"] == 0:
+            self.running.pop(body["model"], None)
+        else:
+            time.sleep(self.load_delays.get(body["model"], 0))
+            self.running[body["model"]] = self.sizes[body["model"]]
+        self._reply({"model": body["model"], "done": True})
+
+    def _reply(self, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestModelResidency(unittest.TestCase):
+    def asyncTest(func):
+        def wrapper(*args, **kwargs):
+            return asyncio.run(func(*args, **kwargs))
+        return wrapper
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeOllama.running.clear()
+        FakeOllama.requests.clear()
+        FakeOllama.load_delays.clear()
+        self.manager = ModelResidencyManager()
+        self.manager.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.manager.ram_budget = 8 * GB
+        self.manager.default_keep_alive = 1800
+        self.manager.keep_alive_overrides = {}
+        self.manager.pinned = set()
+        self.manager._resident.clear()
+        self.manager._sizes = {}
+        self.manager._loading = {}
+        self.manager._in_use = {}
+        self.manager.loads = self.manager.evictions = 0
+
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration("90"), 90)
+        self.assertEqual(parse_duration("-1"), -1)
+        self.assertEqual(parse_duration("1h30m"), 5400)
+        with self.assertRaises(ValueError):
+            parse_duration("soon")
+
+    @asyncTest
+    async def test_least_recently_used_model_is_evicted(self):
+        for model in ["a", "b", "a", "c"]:
+            await self.manager.ensure_loaded(model)
+        self.assertEqual(set(FakeOllama.running), {"a:latest", "c:latest"})
+        self.assertIn(("/api/generate", {"model": "b:latest", "keep_alive": 0}), FakeOllama.requests)
+
+    @asyncTest
+    async def test_models_in_use_and_pinned_models_are_not_evicted(self):
+        self.manager.pin("embedder")
+        await self.manager.ensure_loaded("embedder", embedding=True)
+        async with self.manager.use("a"):
+            await self.manager.ensure_loaded("b")
+            await self.manager.ensure_loaded("c")
+        self.assertEqual(set(FakeOllama.running), {"embedder:latest", "a:latest", "c:latest"})
+        self.assertEqual(FakeOllama.requests[0], ("/api/embed", {"model": "embedder:latest", "keep_alive": -1, "input": []}))
+
+    @asyncTest
+    async def test_resident_models_are_not_blocked_by_a_load(self):
+        await self.manager.ensure_loaded("a")
+        FakeOllama.load_delays["b:latest"] = 1.0
+        loading = asyncio.create_task(self.manager.ensure_loaded("b"))
+        await asyncio.sleep(0.2)  # b is loading
+        start = time.perf_counter()
+        async with self.manager.use("a"):
+            elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.1)
+        # Waiting for a model that is being loaded doesn't load it again
+        await asyncio.gather(loading, self.manager.ensure_loaded("b"))
+        self.assertEqual(self.manager.loads, 2)
+        self.assertEqual(set(FakeOllama.running), {"a:latest", "b:latest"})
+
+    @asyncTest
+    async def test_warm_up_stops_at_the_budget(self):
+        async def active_models():
+            return ["a:latest", "b:latest", "c:latest"]
+        self.manager._active_models = active_models
+        try:
+            await self.manager.warm_up(embedder="embedder")
+        finally:
+            del self.manager._active_models
+        self.assertEqual(set(FakeOllama.running), {"embedder:latest", "a:latest", "b:latest"})
+        self.assertEqual(self.manager.evictions, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+from langchain_core.messages import AIMessage, HumanMessage
+from backend.rephrase import needs_rephrase, query_overlap
+
+HISTORY = [HumanMessage(content="What is a lemma?"), AIMessage(content="A small theorem used to prove a larger one.")]
+
+class TestNeedsRephrase(unittest.TestCase):
+    def test_nothing_to_rephrase_without_history(self):
+        self.assertFalse(needs_rephrase("Can you give an example of it?", []))
+
+    def test_self_contained_questions_are_kept(self):
+        self.assertFalse(needs_rephrase("What is the derivative of sin x with respect to x?", HISTORY))
+        self.assertFalse(needs_rephrase("Explain photosynthesis in plants for a beginner", HISTORY))
+
+    def test_follow_ups_are_rephrased(self):
+        self.assertTrue(needs_rephrase("Why?", HISTORY))
+        self.assertTrue(needs_rephrase("Can you give an example of it?", HISTORY))
+        self.assertTrue(needs_rephrase("And what about the proof of the main theorem?", HISTORY))
+        self.assertTrue(needs_rephrase("How are those used in geometry courses?", HISTORY))
+
+class TestQueryOverlap(unittest.TestCase):
+    def test_overlap(self):
+        self.assertEqual(query_overlap("Why is it true?", "why is it true"), 1.0)
+        self.assertEqual(query_overlap("why is it true", "why is the lemma true"), 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from langchain_core.documents import Document
+from backend.retrievers import HybridRetriever, fts_query, is_keyword_lookup, term_coverage
+
+def docs(*ids):
+    return [Document(id=doc_id, page_content=doc_id) for doc_id in ids]
+
+class TestHybridRetrieval(unittest.TestCase):
+    def test_fts_query_quotes_words(self):
+        self.assertEqual(fts_query('What is "CS101" (NEAR) AND-OR?'), '"what" OR "is" OR "cs101" OR "near" OR "and" OR "or"')
+        self.assertIsNone(fts_query("?!"))
+
+    def test_keyword_lookups(self):
+        self.assertTrue(is_keyword_lookup("CS101 syllabus", 3))
+        self.assertFalse(is_keyword_lookup("What does CS101 cover?", 3))
+        self.assertFalse(is_keyword_lookup("explain the pythagorean theorem to me", 3))
+        self.assertTrue(is_keyword_lookup('"mean value theorem"', 3))
+        self.assertTrue(is_keyword_lookup("numpy.dot", 3))
+        # Short questions in plain words are not lookups
+        self.assertFalse(is_keyword_lookup("explain photosynthesis", 3))
+        self.assertFalse(is_keyword_lookup("derivatives", 3))
+
+    def test_keyword_lookups_with_few_lexical_matches_fall_back_to_hybrid(self):
+        class VectorStore:
+            searches = 0
+
+            async def asimilarity_search(self, query, k):
+                self.searches += 1
+                return docs("v1", "v2", "v3")
+
+        async def search_chunk_texts(assistant_id, query, k):
+            return [(doc, 1.0) for doc in matches[:k]]
+
+        vectorstore = VectorStore()
+        retriever = HybridRetriever(vectorstore=vectorstore, assistant_id="assistant", k=2)
+        with patch("backend.retrievers.search_chunk_texts", search_chunk_texts):
+            matches = docs("l1", "l2", "l3")
+            self.assertEqual([doc.id for doc in asyncio.run(retriever.ainvoke("CS101"))], ["l1", "l2"])
+            self.assertEqual(vectorstore.searches, 0)
+            matches = docs("l1")
+            self.assertEqual([doc.id for doc in asyncio.run(retriever.ainvoke("CS101"))], ["l1", "v1"])
+            self.assertEqual(vectorstore.searches, 1)
+
+    def test_score_threshold_drops_weak_keyword_matches(self):
+        self.assertEqual(term_coverage("Pythagorean theorem proof", "A proof of the pythagorean theorem."), 1.0)
+        self.assertAlmostEqual(term_coverage("Pythagorean theorem proof", "Every theorem needs one."), 1 / 3)
+
+        class VectorStore:
+            async def asimilarity_search_with_relevance_scores(self, query, k):
+                return [(Document(id="v", page_content="similar"), 0.9), (Document(id="w", page_content="far"), 0.2)]
+
+        async def search_chunk_texts(assistant_id, query, k):
+            return [(Document(id=doc_id, page_content=text), -1.0) for doc_id, text in
+                    [("strong", "the pythagorean theorem proof"), ("weak", "a theorem")]][:k]
+
+        retriever = HybridRetriever(vectorstore=VectorStore(), assistant_id="assistant", k=4, score_threshold=0.6)
+        with patch("backend.retrievers.search_chunk_texts", search_chunk_texts):
+            fused = asyncio.run(retriever.ainvoke("pythagorean theorem proof"))
+            # The fast path too: "CS101" is a keyword lookup, and no chunk contains it
+            fast = asyncio.run(HybridRetriever(vectorstore=VectorStore(), assistant_id="assistant", k=1,
+                                               score_threshold=0.6).ainvoke("CS101"))
+        self.assertEqual([doc.id for doc in fused], ["strong", "v"])
+        self.assertEqual([doc.id for doc in fast], ["v"])
+
+    def test_fusion_favours_chunks_ranked_by_both(self):
+        retriever = HybridRetriever(vectorstore=None, assistant_id="assistant", k=3)
+        fused = retriever.fuse(docs("a", "b", "c"), docs("c", "a", "d"))
+        self.assertEqual([doc.id for doc in fused], ["a", "c", "b"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import random
+import unittest
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from backend.text_splitter import OffsetTextSplitter
+
+def random_text(rnd: random.Random, pieces: int) -> str:
+    tokens = ["a", "b", "word", "lemma", " ", "  ", "\n", "\n\n", "\t", "é", "unbrokenwordwithoutanyspaces" * 3]
+    return "".join(rnd.choice(tokens) for _ in range(pieces))
+
+class TestOffsetTextSplitter(unittest.TestCase):
+    def test_matches_recursive_character_text_splitter(self):
+        rnd = random.Random(0)
+        for _ in range(500):
+            text = random_text(rnd, rnd.randint(0, 400))
+            chunk_size = rnd.randint(1, 80)
+            chunk_overlap = rnd.randint(0, chunk_size)
+            expected = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+            actual = OffsetTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+            self.assertEqual(actual, expected, (text, chunk_size, chunk_overlap))
+
+    def test_start_index_is_the_chunk_offset(self):
+        text = random_text(random.Random(1), 2000)
+        doc = Document(page_content=text, metadata={"page": 3})
+        splits = OffsetTextSplitter(chunk_size=200, chunk_overlap=40, add_start_index=True).split_documents([doc])
+        self.assertTrue(splits)
+        for split in splits:
+            self.assertEqual(split.metadata["page"], 3)
+            start = split.metadata["start_index"]
+            self.assertEqual(text[start:start + len(split.page_content)], split.page_content)
+
+    def test_rejects_overlap_larger_than_chunk_size(self):
+        with self.assertRaises(ValueError):
+            OffsetTextSplitter(chunk_size=10, chunk_overlap=20)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+from collections import deque
+from typing import Iterable, List, Optional, Tuple
+from langchain_core.documents import Document
+
+class OffsetTextSplitter:
+    # Single-pass equivalent of RecursiveCharacterTextSplitter with its default settings (separators
+    # "\n\n", "\n", " ", "", separators kept at the start of the next piece, whitespace stripped).
+    # The text is scanned once per separator level and chunks are tracked as (start, end) offsets into it,
+    # so strings are only created for the chunks that are returned. start_index is the chunk's actual
+    # offset, where LangChain searches for the chunk text and can land on an earlier repeat of it.
+    def __init__(self, chunk_size: int = 4000, chunk_overlap: int = 200, add_start_index: bool = False,
+                 separators: Optional[List[str]] = None):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be > 0, got {chunk_size}")
+        if chunk_overlap < 0:
+            raise ValueError(f"chunk_overlap must be >= 0, got {chunk_overlap}")
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller.")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.add_start_index = add_start_index
+        self.separators = separators or ["\n\n", "\n", " ", ""]
+
+    def split_offsets(self, text: str) -> List[Tuple[int, int]]:
+        chunks = []
+        self._split(text, 0, len(text), self.separators, chunks)
+        return chunks
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        splits = []
+        for doc in documents:
+            text = doc.page_content
+            for start, end in self.split_offsets(text):
+                metadata = dict(doc.metadata)
+                if self.add_start_index:
+                    metadata["start_index"] = start
+                splits.append(Document(page_content=text[start:end], metadata=metadata))
+        return splits
+
+    def _split(self, text: str, start: int, end: int, separators: List[str], chunks: List[Tuple[int, int]]):
+        # Use the first separator that occurs in text[start:end]; longer pieces are split again with the ones after it
+        separator, remaining = separators[-1], []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator, remaining = candidate, separators[i + 1:]
+                break
+
+        good = []
+        for piece_start, piece_end in self._pieces(text, start, end, separator):
+            if piece_end - piece_start < self.chunk_size:
+                good.append((piece_start, piece_end))
+                continue
+            if good:
+                self._merge(text, good, chunks)
+                good = []
+            if remaining:
+                self._split(text, piece_start, piece_end, remaining, chunks)
+            else:
+                chunks.append((piece_start, piece_end))
+        if good:
+            self._merge(text, good, chunks)
+
+    def _pieces(self, text: str, start: int, end: int, separator: str) -> Iterable[Tuple[int, int]]:
+        # Each piece after the first starts with an occurrence of the separator
+        if separator == "":
+            return ((i, i + 1) for i in range(start, end))
+        pieces = []
+        piece_start = start
+        position = text.find(separator, start, end)
+        while position != -1:
+            if position > piece_start:
+                pieces.append((piece_start, position))
+            piece_start = position
+            position = text.find(separator, position + len(separator), end)
+        if end > piece_start:
+            pieces.append((piece_start, end))
+        return pieces
+
+    def _merge(self, text: str, pieces: List[Tuple[int, int]], chunks: List[Tuple[int, int]]):
+        # Pieces are contiguous, so a run of them is just the span from the first start to the last end
+        window = deque()
+        total = 0
+        for piece_start, piece_end in pieces:
+            length = piece_end - piece_start
+            if total + length > self.chunk_size and window:
+                self._emit(text, window[0][0], window[-1][1], chunks)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    first_start, first_end = window.popleft()
+                    total -= first_end - first_start
+            window.append((piece_start, piece_end))
+            total += length
+        if window:
+            self._emit(text, window[0][0], window[-1][1], chunks)
+
+    def _emit(self, text: str, start: int, end: int, chunks: List[Tuple[int, int]]):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            chunks.append((start, end))
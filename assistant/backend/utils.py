@@ -1,6 +1,8 @@
 from dotenv import set_key
 from common.paths import base_dir
 from datetime import datetime, timezone
+import os
+import sys
 
 # set up logging
 from common.log import get_logger
@@ -30,4 +32,19 @@ def zip_fields(fields, result):
 def get_current_timestamp():
     current_time = datetime.now(timezone.utc)
     formatted_time = current_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-    return formatted_time
\ No newline at end of file
+    return formatted_time
+
+# Returns the resident set size of this process in bytes, falling back to the
+# peak RSS reported by getrusage where /proc is not available (e.g., macOS)
+def get_current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    except ImportError:
+        return 0
@@ -30,4 +30,6 @@ db_name = 'paios.db'
 db_path = data_dir / db_name
 db_url = f"sqlite+aiosqlite:///{db_path}"
 downloads_dir = data_dir / 'downloads'
-chroma_db_path = data_dir / 'chroma_db'
\ No newline at end of file
+uploads_dir = data_dir / 'uploads'
+chroma_db_path = data_dir / 'chroma_db'
+embedding_cache_path = data_dir / 'embedding_cache.db'
\ No newline at end of file
@@ -32,6 +32,10 @@ config.set_main_option("sqlalchemy.url", f"sqlite:///{db_path}")
 # target_metadata = mymodel.Base.metadata
 target_metadata = SQLModelBase.metadata
 
+# the FTS5 chunk index and its shadow tables are managed by hand in migrations
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == "table" and name.startswith("chunk_fts"))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -57,6 +61,7 @@ def run_migrations_offline() -> None:
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
         include_schemas=True,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -81,6 +86,7 @@ def run_migrations_online() -> None:
             connection=connection,
             target_metadata=target_metadata,
             include_schemas=True,
+            include_object=include_object,
         )
 
         with context.begin_transaction():
@@ -0,0 +1,31 @@
+"""added file content hash
+
+Revision ID: a3f1c9d2e4b7
+Revises: 703574e237a7
+Create Date: 2026-10-18 09:12:31.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f1c9d2e4b7'
+down_revision: Union[str, None] = '703574e237a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+        batch_op.create_index('ix_file_assistant_id_content_hash', ['assistant_id', 'content_hash'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.drop_index('ix_file_assistant_id_content_hash')
+        batch_op.drop_column('content_hash')
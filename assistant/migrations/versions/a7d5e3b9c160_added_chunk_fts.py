@@ -0,0 +1,30 @@
+"""added chunk full-text index
+
+Revision ID: a7d5e3b9c160
+Revises: f3c6d8a1b927
+Create Date: 2026-10-18 18:42:51.904317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d5e3b9c160'
+down_revision: Union[str, None] = 'f3c6d8a1b927'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Chunk text for BM25 search; only the text column is tokenized, the others locate the chunk
+    op.execute("CREATE VIRTUAL TABLE chunk_fts USING fts5("
+               "text, chunk_id UNINDEXED, assistant_id UNINDEXED, file_id UNINDEXED, page_id UNINDEXED, "
+               "page_number UNINDEXED, start_index UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE chunk_fts")
@@ -0,0 +1,39 @@
+"""added indexing job table
+
+Revision ID: b7e2d4f61a05
+Revises: a3f1c9d2e4b7
+Create Date: 2026-10-18 11:03:47.215830
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2d4f61a05'
+down_revision: Union[str, None] = 'a3f1c9d2e4b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('indexing_job',
+        sa.Column('id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('assistant_id', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('files', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column('created_timestamp', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('updated_timestamp', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index('ix_indexing_job_status', 'indexing_job', ['status'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_indexing_job_status', table_name='indexing_job')
+    op.drop_table('indexing_job')
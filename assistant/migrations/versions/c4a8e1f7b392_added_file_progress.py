@@ -0,0 +1,35 @@
+"""added file progress
+
+Revision ID: c4a8e1f7b392
+Revises: b7e2d4f61a05
+Create Date: 2026-10-18 13:26:05.784913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a8e1f7b392'
+down_revision: Union[str, None] = 'b7e2d4f61a05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.add_column(sa.Column('pages_total', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('pages_processed', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('chunks_total', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('chunks_embedded', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.drop_column('chunks_embedded')
+        batch_op.drop_column('chunks_total')
+        batch_op.drop_column('pages_processed')
+        batch_op.drop_column('pages_total')
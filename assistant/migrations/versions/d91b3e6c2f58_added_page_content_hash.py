@@ -0,0 +1,31 @@
+"""added page content hash
+
+Revision ID: d91b3e6c2f58
+Revises: c4a8e1f7b392
+Create Date: 2026-10-18 14:02:47.310258
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd91b3e6c2f58'
+down_revision: Union[str, None] = 'c4a8e1f7b392'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('page') as batch_op:
+        batch_op.add_column(sa.Column('page_number', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('page') as batch_op:
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('page_number')
@@ -0,0 +1,29 @@
+"""added file checkpoint
+
+Revision ID: e2f7a9c4b815
+Revises: d91b3e6c2f58
+Create Date: 2026-10-18 15:11:32.604117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2f7a9c4b815'
+down_revision: Union[str, None] = 'd91b3e6c2f58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.add_column(sa.Column('checkpoint_page', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.drop_column('checkpoint_page')
@@ -0,0 +1,27 @@
+"""added message conversation index
+
+Revision ID: f3c6d8a1b927
+Revises: e2f7a9c4b815
+Create Date: 2026-10-18 16:04:18.221730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c6d8a1b927'
+down_revision: Union[str, None] = 'e2f7a9c4b815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_message_conversation_id_timestamp', 'message', ['conversation_id', 'timestamp'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_message_conversation_id_timestamp', table_name='message')